@@ -0,0 +1,37 @@
+from config import logger
+
+
+def normalize_key(key):
+    """
+    Канонический вид UID карты - целое число из шестнадцатеричных цифр ключа. Пробелы и регистр
+    не важны, поэтому '3D 00 4B 90 5E   ' из базы и '3D004b905e' со считывателя дают одно и то же.
+    Возвращает None, если ключ пуст (NULL в базе) или не является шестнадцатеричным числом.
+    """
+    if isinstance(key, int):
+        return key
+    if isinstance(key, (bytes, bytearray)):
+        key = key.decode("ascii", "replace")
+    if not isinstance(key, str):
+        return None
+    try:
+        return int("".join(key.split()), 16)
+    except ValueError:
+        return None
+
+
+def build_card_index(rows, key_index):
+    """
+    Строит словарь {канонический UID: строка таблицы} по результатам запроса карт.
+    При повторе UID остаётся последняя строка. Строки с нечитаемым ключом пропускаются.
+    """
+    index = {}
+    skipped = 0
+    for row in rows:
+        uid = normalize_key(row[key_index])
+        if uid is None:
+            skipped += 1
+            continue
+        index[uid] = row
+    if skipped:
+        logger.warning(f"Пропущено карт с некорректным ключом: {skipped}")
+    return index
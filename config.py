@@ -46,6 +46,12 @@ class Config:
         self.t1_timeout = config_data["t1_timeout"]
         self.t2_timeout = config_data["t2_timeout"]
         self.t3_timeout = config_data["t3_timeout"]
+        self.lock_pulse_width = config_data.get("lock_pulse_width", 0.115)
+        self.gpio_backend = config_data.get("gpio_backend", "rpi")  # rpi, lgpio, pigpio, poll или fake
+        self.rfid_repeat_window = config_data.get("rfid_repeat_window", 1.0)  # с после цикла замка
+        # thread или asyncio (порт в цикле событий, цикл замка в одном потоке key_executor)
+        self.rfid_transport = config_data.get("rfid_transport", "thread")
+        self.pin_map = config_data.get("pin_map")  # замена pin_map.DEFAULT_PIN_MAP для другой разводки, None - по умолчанию
 
 
 system_config = Config()
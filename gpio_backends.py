@@ -0,0 +1,345 @@
+import mmap
+import threading
+import time
+
+# значения совпадают с константами RPi.GPIO, поэтому вызовы PinController(..., up_down=GPIO.PUD_UP)
+# работают с любым бэкендом
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+# допустимое расхождение времени фронта от ядра с time.monotonic(), с
+KERNEL_CLOCK_TOLERANCE = 10.0
+
+# интервалы опроса PollingBackend, с: быстрый - сразу после изменения, медленный - в простое
+POLL_FAST_INTERVAL = 0.001
+POLL_SLOW_INTERVAL = 0.01
+POLL_ACTIVE_PERIOD = 0.5  # сколько после последнего изменения опрашивать быстро
+
+
+class GpioMemReader:
+    """
+    Читает уровни GPIO 0-31 одним 32-битным чтением регистра GPLEV0 через /dev/gpiomem
+    (BCM2835-BCM2711). Не мешает построчным запросам RPi.GPIO.
+    """
+    GPLEV0 = 0x34
+    SUPPORTED = (b"brcm,bcm2835", b"brcm,bcm2836", b"brcm,bcm2837", b"brcm,bcm2711")
+
+    def __init__(self):
+        with open("/proc/device-tree/compatible", "rb") as f:
+            compatible = f.read()
+        if not any(soc in compatible for soc in self.SUPPORTED):
+            raise OSError("GPLEV0 is not available on this SoC")
+        with open("/dev/gpiomem", "r+b") as f:
+            self.mem = mmap.mmap(f.fileno(), 4096)
+        self.registers = memoryview(self.mem).cast("I")
+
+    def read(self, pins_mask):
+        return self.registers[self.GPLEV0 // 4] & pins_mask
+
+
+class RPiGPIOBackend:
+    """
+    RPi.GPIO (rpi-lgpio): подавление дребезга в пространстве пользователя, время фронта
+    берётся по монотонным часам в момент вызова обработчика. Блокировка bouncetime в RPi.GPIO
+    не включается: её выполняет PinController после подсчёта фронтов, иначе заблокированные
+    фронты не видны ChatterMonitor.
+    """
+    name = "rpi"
+    debounced = False  # фронты приходят с дребезгом, его подавляет PinController
+    hardware = True
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_input(self, pin, pull):
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=pull)
+
+    def read(self, pin):
+        return self.GPIO.input(pin)
+
+    def watch(self, pin, edge, bouncetime, debounce, on_edge):
+        """
+        Подписывает on_edge(level, timestamp) на все фронты пина. debounce и bouncetime
+        не используются: RPi.GPIO умеет только блокировку bouncetime, а она в PinController.
+        """
+        def wrapper(channel):
+            timestamp = time.monotonic()
+            on_edge(self.GPIO.input(pin), timestamp)
+        self.GPIO.add_event_detect(pin, edge, wrapper)
+
+
+class LgpioBackend:
+    """
+    lgpio (gpiochip): подавление дребезга выполняет ядро (gpio_set_debounce_micros), фронты
+    с аппаратной отметкой времени приходят через единственный поток оповещений lgpio.
+    """
+    name = "lgpio"
+    debounced = True
+    hardware = True
+
+    def __init__(self, chip=0):
+        import lgpio
+        self.lgpio = lgpio
+        self.handle = lgpio.gpiochip_open(chip)
+        self.pulls = {PUD_UP: lgpio.SET_PULL_UP, PUD_DOWN: lgpio.SET_PULL_DOWN}
+        self.edges = {RISING: lgpio.RISING_EDGE, FALLING: lgpio.FALLING_EDGE, BOTH: lgpio.BOTH_EDGES}
+        self.line_flags = {}
+        self.callbacks = {}
+
+    def setup_input(self, pin, pull):
+        self.line_flags[pin] = self.pulls[pull]
+        self.lgpio.gpio_claim_input(self.handle, pin, self.line_flags[pin])
+
+    def read(self, pin):
+        return self.lgpio.gpio_read(self.handle, pin)
+
+    def watch(self, pin, edge, bouncetime, debounce, on_edge):
+        """
+        Подписывает on_edge(level, timestamp) на фронты пина; ядро сообщает фронт, только если уровень
+        продержался debounce секунд. Время фронта - отметка ядра (CLOCK_MONOTONIC, нс).
+        """
+        lgpio = self.lgpio
+        lgpio.gpio_claim_alert(self.handle, pin, self.edges[edge], self.line_flags.get(pin, 0))
+        lgpio.gpio_set_debounce_micros(self.handle, pin, int(debounce * 1000000))
+
+        def alert(chip, gpio, level, timestamp):
+            if level > 1:  # срабатывание watchdog, а не фронт
+                return
+            on_edge(level, kernel_timestamp(timestamp))
+        self.callbacks[pin] = lgpio.callback(self.handle, pin, self.edges[edge], alert)
+
+
+class PigpioBackend:
+    """
+    pigpio (демон pigpiod): подавление дребезга выполняет glitch-фильтр демона, фронты приходят
+    через поток оповещений библиотеки pigpio. Tick pigpio - 32-битный счётчик мкс демона, поэтому
+    время фронта берётся по монотонным часам в момент вызова обработчика.
+    """
+    name = "pigpio"
+    debounced = True
+    hardware = True
+
+    def __init__(self):
+        import pigpio
+        self.pigpio = pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise Exception("pigpiod is not running")
+        self.pulls = {PUD_UP: pigpio.PUD_UP, PUD_DOWN: pigpio.PUD_DOWN}
+        self.edges = {RISING: pigpio.RISING_EDGE, FALLING: pigpio.FALLING_EDGE, BOTH: pigpio.EITHER_EDGE}
+        self.callbacks = {}
+
+    def setup_input(self, pin, pull):
+        self.pi.set_mode(pin, self.pigpio.INPUT)
+        self.pi.set_pull_up_down(pin, self.pulls[pull])
+
+    def read(self, pin):
+        return self.pi.read(pin)
+
+    def watch(self, pin, edge, bouncetime, debounce, on_edge):
+        # glitch-фильтр pigpio принимает не больше 300000 мкс
+        self.pi.set_glitch_filter(pin, min(int(debounce * 1000000), 300000))
+
+        def alert(gpio, level, tick):
+            if level > 1:  # срабатывание watchdog, а не фронт
+                return
+            on_edge(level, time.monotonic())
+        self.callbacks[pin] = self.pi.callback(pin, self.edges[edge], alert)
+
+
+class FakeBackend:
+    """
+    GPIO в памяти для проверки и нагрузочных тестов логики комнаты без Raspberry Pi.
+    Фронты подаются методами inject/inject_sequence; обработчик вызывается в потоке вызывающего,
+    как из потока фронтов RPi.GPIO, с той же фильтрацией по направлению фронта.
+    """
+    name = "fake"
+    debounced = False
+    hardware = False
+
+    def __init__(self):
+        self.levels = {}
+        self.watchers = {}
+        self.injected = 0
+        self.delivered = 0
+
+    def setup_input(self, pin, pull):
+        self.levels.setdefault(pin, 1 if pull == PUD_UP else 0)
+
+    def read(self, pin):
+        return self.levels.get(pin, 1)
+
+    def watch(self, pin, edge, bouncetime, debounce, on_edge):
+        # [направление, обработчик]
+        self.watchers[pin] = [edge, on_edge]
+
+    def inject(self, pin, level, timestamp=None):
+        """
+        Устанавливает уровень пина. Если уровень изменился и фронт подходит подписке, вызывает
+        обработчик. Возвращает True, если обработчик был вызван.
+        """
+        self.injected += 1
+        previous = self.levels.get(pin, 1)
+        self.levels[pin] = level
+        watcher = self.watchers.get(pin)
+        if previous == level or watcher is None:
+            return False
+        edge, on_edge = watcher
+        if (edge == RISING and not level) or (edge == FALLING and level):
+            return False
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.delivered += 1
+        on_edge(level, timestamp)
+        return True
+
+    def inject_sequence(self, pin, levels, interval=0.0):
+        """
+        Подаёт последовательность уровней (например, дребезг 0,1,0,1,0) с паузой interval между ними.
+        """
+        delivered = 0
+        for level in levels:
+            delivered += self.inject(pin, level)
+            if interval:
+                time.sleep(interval)
+        return delivered
+
+
+class PollingBackend:
+    """
+    Опрос вместо прерываний для плат, где фронты теряются. Один поток на все пины: за такт
+    читается маска уровней всех отслеживаемых пинов (GPLEV0 одним чтением или по пину через
+    вложенный бэкенд), изменения находятся одним XOR с предыдущей маской, и обработчики
+    вызываются только для изменившихся битов. Сразу после изменения опрос идёт раз в
+    POLL_FAST_INTERVAL, после POLL_ACTIVE_PERIOD без изменений интервал удваивается до
+    POLL_SLOW_INTERVAL.
+    """
+    name = "poll"
+    debounced = False
+
+    def __init__(self, inner=None, fast_interval=POLL_FAST_INTERVAL, slow_interval=POLL_SLOW_INTERVAL,
+                 active_period=POLL_ACTIVE_PERIOD):
+        self.inner = inner if inner is not None else RPiGPIOBackend()
+        self.hardware = self.inner.hardware
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.active_period = active_period
+        self.lock = threading.Lock()
+        self.watchers = {}  # пин -> [направление, обработчик]
+        self.pins_mask = 0
+        self.mask = 0
+        self.ticks = 0
+        self.changes = 0
+        self.mem_reader = None
+        if self.hardware:
+            try:
+                self.mem_reader = GpioMemReader()
+            except Exception:
+                self.mem_reader = None
+        self.thread = None
+
+    def setup_input(self, pin, pull):
+        self.inner.setup_input(pin, pull)
+
+    def read(self, pin):
+        return self.inner.read(pin)
+
+    def read_mask(self, pins_mask):
+        if self.mem_reader is not None:
+            return self.mem_reader.read(pins_mask)
+        mask = 0
+        pin = 0
+        while pins_mask >> pin:
+            if (pins_mask >> pin) & 1 and self.inner.read(pin):
+                mask |= 1 << pin
+            pin += 1
+        return mask
+
+    def watch(self, pin, edge, bouncetime, debounce, on_edge):
+        with self.lock:
+            self.watchers[pin] = [edge, on_edge]
+            self.mask = (self.mask & ~(1 << pin)) | (self.inner.read(pin) << pin)
+            self.pins_mask |= 1 << pin
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def poll(self):
+        """
+        Один такт опроса. Возвращает True, если хотя бы один пин изменился.
+        """
+        with self.lock:
+            pins_mask = self.pins_mask
+            previous = self.mask
+        mask = self.read_mask(pins_mask)
+        self.ticks += 1
+        changed = mask ^ previous
+        if not changed:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.mask = mask
+        self.changes += 1
+        while changed:
+            low = changed & -changed
+            changed ^= low
+            pin = low.bit_length() - 1
+            level = 1 if mask & low else 0
+            edge, on_edge = self.watchers[pin]
+            if (edge == RISING and not level) or (edge == FALLING and level):
+                continue
+            on_edge(level, now)
+        return True
+
+    def run(self):
+        interval = self.fast_interval
+        last_change = time.monotonic()
+        while True:
+            try:
+                changed = self.poll()
+            except Exception as e:
+                print(f"Ошибка опроса GPIO: {e}")
+                changed = False
+            now = time.monotonic()
+            if changed:
+                last_change = now
+                interval = self.fast_interval
+            elif now - last_change > self.active_period:
+                interval = min(interval * 2, self.slow_interval)
+            time.sleep(interval)
+
+    def stats(self):
+        return {"ticks": self.ticks, "changes": self.changes, "pins": bin(self.pins_mask).count("1")}
+
+
+def kernel_timestamp(timestamp_ns):
+    """
+    Переводит отметку времени ядра в секунды шкалы time.monotonic(). Если отметка не похожа
+    на CLOCK_MONOTONIC (другая шкала часов), используется текущее монотонное время.
+    """
+    timestamp = timestamp_ns / 1e9
+    now = time.monotonic()
+    if abs(now - timestamp) > KERNEL_CLOCK_TOLERANCE:
+        return now
+    return timestamp
+
+
+BACKENDS = {
+    RPiGPIOBackend.name: RPiGPIOBackend,
+    LgpioBackend.name: LgpioBackend,
+    PigpioBackend.name: PigpioBackend,
+    FakeBackend.name: FakeBackend,
+    PollingBackend.name: PollingBackend,
+}
+
+
+def create_backend(name):
+    if name not in BACKENDS:
+        raise Exception(f"Unknown GPIO backend '{name}'. Expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
@@ -0,0 +1,68 @@
+import sys
+import time
+
+import lgpio
+
+import pin_controller
+from config import logger
+from gpio_backends import FALLING, PUD_UP, create_backend
+from pin_controller import PinController
+
+# Замер задержки фронт -> начало колбэка PinController для выбранного бэкенда.
+# Выход OUT_PIN соединяется перемычкой со входом IN_PIN; выход переключается через lgpio,
+# колбэк отмечает время своего запуска.
+# Запуск: python gpio_latency_test.py rpi|lgpio [OUT_PIN] [IN_PIN] [ITERATIONS]
+
+BACKEND = sys.argv[1] if len(sys.argv) > 1 else "rpi"
+OUT_PIN = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+IN_PIN = int(sys.argv[3]) if len(sys.argv) > 3 else 21
+ITERATIONS = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+STABLE_TIME = 0.005  # одинаковое время стабилизации для обоих бэкендов, с
+
+callback_times = []
+
+
+def on_callback(controller):
+    callback_times.append((time.monotonic(), controller.last_edge))
+
+
+def main():
+    pin_controller.set_backend(create_backend(BACKEND))
+    h = lgpio.gpiochip_open(0)
+    lgpio.gpio_claim_output(h, OUT_PIN, 1)
+    PinController(IN_PIN, on_callback, up_down=PUD_UP, react_on=FALLING, bouncetime=1, stable_time=STABLE_TIME)
+    time.sleep(0.5)
+
+    latencies = []
+    edge_latencies = []
+    try:
+        for _ in range(ITERATIONS):
+            callback_times.clear()
+            written = time.monotonic()
+            lgpio.gpio_write(h, OUT_PIN, 0)
+            deadline = written + 1.0
+            while not callback_times and time.monotonic() < deadline:
+                time.sleep(0.0005)
+            if callback_times:
+                started, edge_time = callback_times[0]
+                latencies.append(started - written)
+                edge_latencies.append(started - edge_time)
+            lgpio.gpio_write(h, OUT_PIN, 1)
+            time.sleep(0.05)
+    finally:
+        lgpio.gpio_free(h, OUT_PIN)
+        lgpio.gpiochip_close(h)
+
+    if not latencies:
+        logger.error(f"Колбэк не вызывался ни разу. Проверьте перемычку GPIO{OUT_PIN} -> GPIO{IN_PIN}")
+        return
+    latencies.sort()
+    edge_latencies.sort()
+    logger.info(f"Бэкенд {BACKEND}: {len(latencies)}/{ITERATIONS} фронтов, stable_time {STABLE_TIME * 1000:.1f} мс")
+    for name, values in (("запись -> колбэк", latencies), ("отметка фронта -> колбэк", edge_latencies)):
+        logger.info(f"{name}: медиана {values[len(values) // 2] * 1000:.3f} мс, "
+                    f"p99 {values[int(len(values) * 0.99)] * 1000:.3f} мс, макс {values[-1] * 1000:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
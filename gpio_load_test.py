@@ -0,0 +1,147 @@
+import sys
+import time
+import random
+import threading
+
+import pin_controller
+from config import logger
+from gpio_backends import BOTH, FALLING, FakeBackend
+from pin_controller import PinController, chatter_monitor, dispatcher
+
+# Нагрузочный тест PinController на имитации GPIO (Raspberry Pi не нужен).
+# На каждый пин подаются пачки дребезга, которые заканчиваются установившимся низким уровнем;
+# проверяется, что на каждую пачку вызван ровно один колбэк, и измеряется задержка.
+# Запуск: python gpio_load_test.py [PINS] [BURSTS] [BOUNCES]
+# python gpio_load_test.py edge [PINS] [ROUNDS] - стоимость on_edge на фронт и время от первого
+# фронта пачки дребезга (1 мс между фронтами) до единственного колбэка
+
+EDGE_MODE = sys.argv[1:2] == ["edge"]
+ARGS = sys.argv[2:] if EDGE_MODE else sys.argv[1:]
+PINS = int(ARGS[0]) if len(ARGS) > 0 else 20
+BURSTS = int(ARGS[1]) if len(ARGS) > 1 else 50
+BOUNCES = int(ARGS[2]) if len(ARGS) > 2 else 10
+STABLE_TIME = 0.005
+EDGE_BOUNCE = [i % 2 for i in range(9)]  # 0,1,0,...,0 - девять фронтов, установившийся 0
+EDGE_INTERVAL = 0.001
+
+latencies = []
+
+
+def on_callback(controller):
+    latencies.append(time.monotonic() - controller.last_edge)
+
+
+def main():
+    backend = FakeBackend()
+    pin_controller.set_backend(backend)
+    # пачки подаются чаще порога переключений ChatterMonitor: карантин здесь проверял бы не дребезг, а сам тест
+    chatter_monitor.max_transitions = float("inf")
+    pins = list(range(1, PINS + 1))
+    for pin in pins:
+        PinController(pin, on_callback, react_on=FALLING, bouncetime=0, stable_time=STABLE_TIME)
+
+    started = time.monotonic()
+    for _ in range(BURSTS):
+        random.shuffle(pins)
+        for pin in pins:
+            # дребезг 0,1,0,1,... и установившийся 0
+            backend.inject_sequence(pin, [i % 2 for i in range(BOUNCES * 2)] + [0])
+        time.sleep(STABLE_TIME * 3)
+        for pin in pins:
+            backend.inject(pin, 1)
+    injecting = time.monotonic() - started
+    time.sleep(0.5)
+
+    stats = dispatcher.stats()
+    expected = PINS * BURSTS
+    logger.info(f"Подано {backend.injected} уровней ({backend.delivered} фронтов) за {injecting:.2f} с, "
+                f"{backend.delivered / injecting:.0f} фронтов/с")
+    logger.info(f"Колбэков {len(latencies)} из {expected} ожидаемых, отброшено {stats['dropped']}")
+    if latencies:
+        latencies.sort()
+        logger.info(f"Последний фронт -> колбэк: медиана {latencies[len(latencies) // 2] * 1000:.2f} мс, "
+                    f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} мс, макс {latencies[-1] * 1000:.2f} мс "
+                    f"(включая stable_time {STABLE_TIME * 1000:.0f} мс)")
+
+
+def percentiles(samples, scale, unit):
+    samples.sort()
+    return (f"медиана {samples[len(samples) // 2] * scale:.2f} {unit}, "
+            f"p99 {samples[int(len(samples) * 0.99)] * scale:.2f} {unit}, макс {samples[-1] * scale:.2f} {unit}")
+
+
+def edge_bench():
+    """
+    Каждый фронт пачки проходит через on_edge в потоке вызывающего, как из потока фронтов RPi.GPIO.
+    Первый фронт пачки ставит пин в Debouncer, остальные только записываются. Пачки одного пина
+    идут не чаще раза в 0,7 с, чтобы не сработал карантин ChatterMonitor.
+    """
+    backend = FakeBackend()
+    pin_controller.set_backend(backend)
+    pins = list(range(1, PINS + 1))
+    first_edge = []
+    burst_edge = []
+    burst_started = {}
+    callbacks = {}
+    lock = threading.Lock()
+
+    def on_edge_callback(controller):
+        with lock:
+            callbacks.setdefault(controller.pin, []).append(time.monotonic() - burst_started[controller.pin])
+
+    def timed(controller):
+        on_edge = controller.on_edge
+
+        def wrapper(level, timestamp):
+            first = not controller.settle_scheduled
+            started = time.perf_counter()
+            on_edge(level, timestamp)
+            elapsed = time.perf_counter() - started
+            (first_edge if first else burst_edge).append(elapsed)
+        return wrapper
+
+    for pin in pins:
+        # bouncetime как у всех пинов в pin_map: пачки одного пина идут реже, чем раз в 0,5 с
+        controller = PinController(pin, on_edge_callback, react_on=BOTH, bouncetime=500)
+        backend.watchers[pin][1] = timed(controller)
+
+    rounds = int(ARGS[1]) if len(ARGS) > 1 else 20
+    for _ in range(rounds):
+        random.shuffle(pins)
+        for pin in pins:
+            burst_started[pin] = time.monotonic()
+            backend.inject_sequence(pin, EDGE_BOUNCE, EDGE_INTERVAL)
+        time.sleep(0.1)
+        for pin in pins:
+            backend.inject(pin, 1)
+        time.sleep(0.6)
+    time.sleep(0.5)
+
+    counts = [len(callbacks.get(pin, ())) for pin in pins]
+    delays = [delay for pin_delays in callbacks.values() for delay in pin_delays]
+    # фронты подряд без пауз: стоимость on_edge без пробуждений потоков между фронтами
+    hot_edge = []
+    for pin in pins:
+        backend.watchers[pin][1] = pin_controller.controllers[pin].on_edge
+        levels = [i % 2 for i in range(1000)] + [0]
+        started = time.perf_counter()
+        backend.inject_sequence(pin, levels)
+        hot_edge.append((time.perf_counter() - started) / len(levels))
+    time.sleep(0.1)
+
+    logger.info(f"{PINS} пинов x {rounds} пачек по {len(EDGE_BOUNCE)} фронтов с шагом {EDGE_INTERVAL * 1000:.0f} мс, "
+                f"stable_time {pin_controller.controllers[pins[0]].stable_time * 1000:.0f} мс")
+    logger.info(f"on_edge, первый фронт пачки: {percentiles(first_edge, 1e6, 'мкс')}")
+    logger.info(f"on_edge, фронт внутри пачки: {percentiles(burst_edge, 1e6, 'мкс')}")
+    logger.info(f"inject + on_edge, фронты подряд: {percentiles(hot_edge, 1e6, 'мкс')}")
+    logger.info(f"Колбэков на пачку: мин {min(counts) / rounds:.2f}, макс {max(counts) / rounds:.2f} (ожидается 1), "
+                f"в карантине {chatter_monitor.stats()['quarantined']}")
+    if delays:
+        logger.info(f"Первый фронт -> колбэк: {percentiles(delays, 1000, 'мс')}")
+
+
+if __name__ == "__main__":
+    if EDGE_MODE:
+        edge_bench()
+    else:
+        main()
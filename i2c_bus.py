@@ -0,0 +1,181 @@
+import fcntl
+import threading
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+import smbus2
+
+from config import logger
+
+OP_READ_BYTE = 0
+OP_WRITE_BYTE = 1
+OP_WRITE_BYTE_DATA = 2
+OP_WRITE_QUICK = 3
+OP_NAMES = ("read_byte", "write_byte", "write_byte_data", "write_quick")
+
+OUTCOME_OK = 0
+OUTCOME_ERROR = 1
+OUTCOME_NAMES = ("ok", "error")
+
+# верхние границы корзин гистограммы задержек, мкс; последняя корзина - всё, что дольше
+LATENCY_BUCKETS_US = (50, 100, 200, 300, 500, 750, 1000, 2000, 5000, 10000, 50000)
+
+I2C_TIMEOUT = 0x0702  # ioctl таймаута адаптера, в единицах 10 мс
+DEFAULT_TIMEOUT = 1.0  # таймаут адаптера по умолчанию в ядре
+
+
+class I2CStats:
+    """
+    Счётчики и гистограммы задержек транзакций I2C по адресу, операции и результату.
+    Все массивы выделяются заранее, поэтому запись измерения не создаёт новых объектов-контейнеров
+    и не влияет на измеряемые интервалы. Вызывается под блокировкой шины.
+    """
+
+    def __init__(self):
+        self.bounds = tuple(bound * 1000 for bound in LATENCY_BUCKETS_US)
+        self.bucket_count = len(self.bounds) + 1
+        slots = 128 * len(OP_NAMES) * len(OUTCOME_NAMES)
+        self.counts = array('Q', bytes(8 * slots * self.bucket_count))
+        self.total_ns = array('Q', bytes(8 * slots))
+        self.max_ns = array('Q', bytes(8 * slots))
+
+    def record(self, address, op, outcome, elapsed_ns):
+        slot = ((address & 0x7F) * len(OP_NAMES) + op) * len(OUTCOME_NAMES) + outcome
+        self.counts[slot * self.bucket_count + bisect_left(self.bounds, elapsed_ns)] += 1
+        self.total_ns[slot] += elapsed_ns
+        if elapsed_ns > self.max_ns[slot]:
+            self.max_ns[slot] = elapsed_ns
+
+    def snapshot(self):
+        """
+        Возвращает ненулевые счётчики в виде словаря {адрес: {операция: {результат: сводка}}}.
+        """
+        labels = [f"<={bound}us" for bound in LATENCY_BUCKETS_US] + [f">{LATENCY_BUCKETS_US[-1]}us"]
+        result = {}
+        for address in range(128):
+            for op, op_name in enumerate(OP_NAMES):
+                for outcome, outcome_name in enumerate(OUTCOME_NAMES):
+                    slot = (address * len(OP_NAMES) + op) * len(OUTCOME_NAMES) + outcome
+                    buckets = self.counts[slot * self.bucket_count:(slot + 1) * self.bucket_count]
+                    count = sum(buckets)
+                    if not count:
+                        continue
+                    result.setdefault(hex(address), {}).setdefault(op_name, {})[outcome_name] = {
+                        "count": count,
+                        "mean_us": round(self.total_ns[slot] / count / 1000, 1),
+                        "max_us": round(self.max_ns[slot] / 1000, 1),
+                        "buckets": dict(zip(labels, buckets)),
+                    }
+        return result
+
+
+class I2CBus:
+    """
+    Владелец физической шины I2C. Все транзакции выполняются под одной блокировкой,
+    поэтому шину могут одновременно использовать контроллеры реле и любые читатели.
+    """
+
+    def __init__(self, bus_num=1, device=None):
+        """
+        device - объект с интерфейсом smbus.SMBus; по умолчанию открывается smbus2.SMBus(bus_num),
+        у которого есть файловый дескриптор fd для ioctl (таймаут адаптера).
+        """
+        self.bus_num = bus_num
+        self.lock = threading.RLock()
+        self.stats = I2CStats()
+        self.__device = device if device is not None else smbus2.SMBus(bus_num)
+
+    def write_byte_data(self, address, register, value):
+        with self.lock:
+            started = perf_counter_ns()
+            try:
+                self.__device.write_byte_data(address, register, value)
+            except Exception:
+                self.stats.record(address, OP_WRITE_BYTE_DATA, OUTCOME_ERROR, perf_counter_ns() - started)
+                raise
+            self.stats.record(address, OP_WRITE_BYTE_DATA, OUTCOME_OK, perf_counter_ns() - started)
+
+    def write_byte(self, address, value):
+        with self.lock:
+            started = perf_counter_ns()
+            try:
+                self.__device.write_byte(address, value)
+            except Exception:
+                self.stats.record(address, OP_WRITE_BYTE, OUTCOME_ERROR, perf_counter_ns() - started)
+                raise
+            self.stats.record(address, OP_WRITE_BYTE, OUTCOME_OK, perf_counter_ns() - started)
+
+    def read_byte(self, address):
+        with self.lock:
+            started = perf_counter_ns()
+            try:
+                value = self.__device.read_byte(address)
+            except Exception:
+                self.stats.record(address, OP_READ_BYTE, OUTCOME_ERROR, perf_counter_ns() - started)
+                raise
+            self.stats.record(address, OP_READ_BYTE, OUTCOME_OK, perf_counter_ns() - started)
+            return value
+
+    def write_quick(self, address):
+        with self.lock:
+            started = perf_counter_ns()
+            try:
+                self.__device.write_quick(address)
+            except Exception:
+                self.stats.record(address, OP_WRITE_QUICK, OUTCOME_ERROR, perf_counter_ns() - started)
+                raise
+            self.stats.record(address, OP_WRITE_QUICK, OUTCOME_OK, perf_counter_ns() - started)
+
+    def set_timeout(self, timeout):
+        """
+        Устанавливает таймаут транзакции адаптера (секунды). Возвращает False с предупреждением в журнале,
+        если устройство шины не даёт доступа к файловому дескриптору (например, python-smbus или имитация)
+        или ядро отклонило ioctl.
+        """
+        fd = getattr(self.__device, "fd", None)
+        if fd is None:
+            logger.warning(f"Таймаут шины I2C {self.bus_num} не установлен: у устройства шины нет файлового дескриптора")
+            return False
+        try:
+            with self.lock:
+                fcntl.ioctl(fd, I2C_TIMEOUT, max(1, round(timeout * 100)))
+        except OSError as e:
+            logger.warning(f"Таймаут шины I2C {self.bus_num} не установлен: {str(e)}")
+            return False
+        return True
+
+    @contextmanager
+    def session(self):
+        """
+        Удерживает шину на время нескольких транзакций подряд (например, чтение обоих чипов).
+        """
+        with self.lock:
+            yield self
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus(bus_num=1):
+    """
+    Возвращает общий менеджер шины с номером bus_num, открывая её при первом обращении.
+    """
+    with _buses_lock:
+        bus = _buses.get(bus_num)
+        if bus is None:
+            bus = I2CBus(bus_num)
+            _buses[bus_num] = bus
+        return bus
+
+
+def register_bus(bus_num, device):
+    """
+    Подменяет устройство шины bus_num (например, имитацией шины для проверки без железа).
+    """
+    with _buses_lock:
+        bus = I2CBus(bus_num, device)
+        _buses[bus_num] = bus
+        return bus
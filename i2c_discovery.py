@@ -0,0 +1,124 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from config import logger
+from i2c_bus import DEFAULT_TIMEOUT
+
+DEVICE_MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "i2c_devices.json")
+
+SCAN_FIRST = 0x03
+SCAN_LAST = 0x77
+RELAY_ADDRESSES = range(0x38, 0x40)  # PCA-расширители реле
+# как в i2cdetect: в этих диапазонах quick write может испортить устройство (EEPROM и т.п.), поэтому читаем
+READ_PROBE_RANGES = (range(0x30, 0x38), range(0x50, 0x60))
+PROBE_TIMEOUT = 0.01  # таймаут адаптера на время опроса, с
+
+
+class I2CDeviceNotFound(Exception):
+    pass
+
+
+def bus_fingerprint(bus):
+    """
+    Отпечаток шины: номер и имя адаптера из sysfs. Если он изменился, сохранённая карта недействительна.
+    """
+    try:
+        with open(f"/sys/bus/i2c/devices/i2c-{bus.bus_num}/name") as f:
+            name = f.read().strip()
+    except OSError:
+        name = ""
+    return f"i2c-{bus.bus_num}:{name}"
+
+
+def probe(bus, address):
+    """
+    Проверяет наличие устройства по адресу одной короткой транзакцией.
+    """
+    try:
+        if any(address in probe_range for probe_range in READ_PROBE_RANGES):
+            bus.read_byte(address)
+        else:
+            bus.write_quick(address)
+        return True
+    except OSError:
+        return False
+
+
+def load_device_map(path=DEVICE_MAP_PATH):
+    try:
+        with open(path) as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def save_device_map(bus, devices, path=DEVICE_MAP_PATH):
+    device_map = {
+        "fingerprint": bus_fingerprint(bus),
+        "devices": [hex(address) for address in sorted(devices)],
+        "scanned_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        with open(path, "w") as f:
+            f.write(json.dumps(device_map, indent=2))
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить карту устройств I2C {path}: {str(e)}")
+
+
+def scan(bus, path=DEVICE_MAP_PATH):
+    """
+    Полный опрос адресов 0x03-0x77 с коротким таймаутом адаптера. Результат сохраняется в карту устройств.
+    """
+    started = time.monotonic()
+    bounded = bus.set_timeout(PROBE_TIMEOUT)
+    try:
+        with bus.session():
+            devices = [address for address in range(SCAN_FIRST, SCAN_LAST + 1) if probe(bus, address)]
+    finally:
+        if bounded:
+            bus.set_timeout(DEFAULT_TIMEOUT)
+    logger.info(f"Сканирование шины I2C: найдено {[hex(a) for a in devices]} "
+                f"за {(time.monotonic() - started) * 1000:.1f} мс")
+    save_device_map(bus, devices, path)
+    return devices
+
+
+def discover(bus, expected=(), path=DEVICE_MAP_PATH):
+    """
+    Возвращает список адресов устройств на шине. При совпадении отпечатка шины с сохранённой картой
+    повторно проверяются только известные адреса реле (0x38-0x3F) и ожидаемые адреса; если ожидаемое
+    устройство не найдено или карты нет, выполняется полный опрос.
+    """
+    device_map = load_device_map(path)
+    if device_map and device_map.get("fingerprint") == bus_fingerprint(bus):
+        cached = {int(address, 16) for address in device_map.get("devices", [])}
+        to_verify = sorted({address for address in cached if address in RELAY_ADDRESSES} | set(expected))
+        started = time.monotonic()
+        bounded = bus.set_timeout(PROBE_TIMEOUT)
+        try:
+            with bus.session():
+                present = {address for address in to_verify if probe(bus, address)}
+        finally:
+            if bounded:
+                bus.set_timeout(DEFAULT_TIMEOUT)
+        logger.info(f"Проверка известных устройств I2C {[hex(a) for a in to_verify]}: "
+                    f"{(time.monotonic() - started) * 1000:.1f} мс")
+        if present.issuperset(expected):
+            devices = {address for address in cached if address not in to_verify} | present
+            if devices != cached:
+                save_device_map(bus, devices, path)
+            return sorted(devices)
+    return scan(bus, path)
+
+
+def require_devices(bus, addresses, path=DEVICE_MAP_PATH):
+    """
+    Убеждается, что все устройства addresses присутствуют на шине, иначе выбрасывает I2CDeviceNotFound.
+    """
+    devices = discover(bus, expected=addresses, path=path)
+    missing = [hex(address) for address in addresses if address not in devices]
+    if missing:
+        raise I2CDeviceNotFound(f"Устройства I2C не отвечают на шине {bus.bus_num}: {', '.join(missing)}")
+    return devices
@@ -4,6 +4,9 @@ import smbus
 import time
 import logging
 
+from i2c_bus import get_bus
+from i2c_discovery import scan
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -64,20 +67,13 @@ class RelayControllerTest:
 def scan_i2c_bus():
     """Сканирует шину I2C для поиска подключенных устройств"""
     logger.info("Сканирование шины I2C...")
-    bus = smbus.SMBus(1)
-    found_devices = []
-    
-    for address in range(0x03, 0x78):
-        try:
-            bus.read_byte(address)
-            logger.info(f"Найдено устройство I2C по адресу: 0x{address:02X}")
-            found_devices.append(address)
-        except Exception:
-            pass
+    found_devices = scan(get_bus(1))
     
     if not found_devices:
         logger.warning("Устройства I2C не обнаружены")
     else:
+        for address in found_devices:
+            logger.info(f"Найдено устройство I2C по адресу: 0x{address:02X}")
         logger.info(f"Всего найдено устройств: {len(found_devices)}")
     
     return found_devices
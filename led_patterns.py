@@ -0,0 +1,145 @@
+import threading
+import time
+
+from config import logger
+
+
+class LedPattern:
+    """
+    Описание светового шаблона: последовательность кадров (включён, длительность в секундах),
+    количество повторов по умолчанию (None - бесконечно) и приоритет по умолчанию.
+    """
+
+    def __init__(self, name, frames, repeat=None, priority=0):
+        self.name = name
+        self.frames = frames
+        self.repeat = repeat
+        self.priority = priority
+        self.cycle = sum(duration for _, duration in frames)
+
+    def frame_at(self, elapsed):
+        """
+        Возвращает (включён ли светодиод, время до смены кадра) для момента elapsed от начала цикла.
+        """
+        position = elapsed % self.cycle
+        for is_on, duration in self.frames:
+            if position < duration:
+                return is_on, duration - position
+            position -= duration
+        return self.frames[-1][0], self.cycle - position
+
+
+PATTERNS = {
+    "steady": LedPattern("steady", ((True, 1.0),)),
+    "blink": LedPattern("blink", ((True, 0.2), (False, 0.2))),
+    "fast_blink": LedPattern("fast_blink", ((True, 0.1), (False, 0.1))),
+    "double_flash": LedPattern("double_flash", ((True, 0.1), (False, 0.1), (True, 0.1), (False, 0.7))),
+}
+
+
+class ActivePattern:
+
+    def __init__(self, bit, pattern, repeat, priority, started):
+        self.bit = bit
+        self.pattern = pattern
+        self.repeat = repeat
+        self.priority = priority
+        self.started = started
+
+    def render(self, now):
+        """
+        Возвращает (включён, время до следующей смены) или None, если шаблон отыгран.
+        """
+        elapsed = now - self.started
+        if self.repeat is not None and elapsed >= self.repeat * self.pattern.cycle:
+            return None
+        is_on, next_change = self.pattern.frame_at(elapsed)
+        if self.repeat is not None:
+            next_change = min(next_change, self.repeat * self.pattern.cycle - elapsed)
+        return is_on, next_change
+
+
+class LedPatternEngine(threading.Thread):
+    """
+    Единый таймер для всех светодиодов на битах одного контроллера реле.
+    Активные шаблоны хранятся по ключу; для каждого бита побеждает шаблон с наибольшим
+    приоритетом. Кадр отрисовывается в общую маску и записывается одной командой apply(),
+    причём только когда маска изменилась. Запуск и отмена шаблона не блокируют вызывающего.
+    """
+
+    def __init__(self, relay_controller, bits):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.relay_controller = relay_controller
+        self.managed_mask = 0
+        for bit in bits:
+            self.managed_mask |= 1 << bit
+        self.stopped = threading.Event()
+        self.changed = threading.Event()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.rendered_mask = 0  # светодиоды погашены при инициализации контроллера
+
+    def start_pattern(self, key, bit, name, repeat=None, priority=None):
+        """
+        Запускает шаблон name на бите bit под ключом key (шаблон с тем же ключом заменяется).
+        """
+        pattern = PATTERNS[name]
+        entry = ActivePattern(bit, pattern,
+                              pattern.repeat if repeat is None else repeat,
+                              pattern.priority if priority is None else priority,
+                              time.monotonic())
+        with self.lock:
+            # перезапущенный шаблон становится самым новым: при равном приоритете побеждает последний
+            self.active.pop(key, None)
+            self.active[key] = entry
+        self.changed.set()
+
+    def cancel(self, key):
+        """
+        Отменяет шаблон с ключом key, если он активен.
+        """
+        with self.lock:
+            self.active.pop(key, None)
+        self.changed.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.changed.set()
+        self.join()
+
+    def render(self, now):
+        """
+        Отрисовывает активные шаблоны в маску включённых светодиодов.
+        Возвращает (маска, время до следующей смены кадра или None).
+        """
+        winners = {}
+        next_change = None
+        with self.lock:
+            for key, entry in list(self.active.items()):
+                frame = entry.render(now)
+                if frame is None:
+                    del self.active[key]
+                    continue
+                current = winners.get(entry.bit)
+                if current is None or entry.priority >= current[0]:
+                    winners[entry.bit] = (entry.priority, frame[0])
+                if next_change is None or frame[1] < next_change:
+                    next_change = frame[1]
+        on_mask = 0
+        for bit, (_, is_on) in winners.items():
+            if is_on:
+                on_mask |= 1 << bit
+        return on_mask & self.managed_mask, next_change
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.changed.clear()
+            on_mask, next_change = self.render(time.monotonic())
+            if on_mask != self.rendered_mask:
+                try:
+                    self.relay_controller.apply(set_mask=on_mask, clear_mask=self.managed_mask & ~on_mask, delay=0)
+                    self.rendered_mask = on_mask
+                except Exception as e:
+                    logger.error(f"Ошибка отрисовки светодиодов: {str(e)}")
+            self.changed.wait(next_change)
@@ -1,15 +1,450 @@
-import RPi.GPIO as GPIO
+import heapq
+import queue
+import threading
 import time
-from config import logger
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple
+from datetime import datetime
+from config import logger, system_config
+from gpio_backends import BOTH, FALLING, PUD_DOWN, PUD_UP, RISING, GpioMemReader, create_backend
+
+# все созданные контроллеры по номеру пина (для группового чтения)
+controllers = {}
+
+backend = None
+
+
+def get_backend():
+    """
+    Бэкенд GPIO, выбранный в config.json (gpio_backend), создаётся при первом обращении.
+    """
+    global backend
+    if backend is None:
+        backend = create_backend(system_config.gpio_backend)
+        logger.info(f"GPIO backend: {backend.name}")
+    return backend
+
+
+def set_backend(new_backend):
+    """
+    Подменяет бэкенд GPIO; вызывать до создания контроллеров.
+    """
+    global backend
+    backend = new_backend
+
+
+class PinSnapshot(namedtuple("PinSnapshot", ("mask", "pins_mask", "timestamp"))):
+    """
+    Неизменяемый снимок уровней: mask - уровни (бит N = пин N), pins_mask - какие пины прочитаны,
+    timestamp - время чтения по монотонным часам.
+    """
+    __slots__ = ()
+
+    def level(self, pin):
+        return (self.mask >> pin) & 1
+
+
+class InputLoopReader:
+    """
+    Запасной вариант: один проход чтения бэкенда по нужным пинам, без пауз и колбэков.
+    """
+
+    def read(self, pins_mask):
+        read = get_backend().read
+        mask = 0
+        pin = 0
+        while pins_mask >> pin:
+            if (pins_mask >> pin) & 1 and read(pin):
+                mask |= 1 << pin
+            pin += 1
+        return mask
+
+
+class EdgeHistory:
+    """
+    Кольцевой буфер последних фронтов пина на заранее выделенных массивах: монотонное время,
+    уровень и признак того, что фронт пережил подавление дребезга (привёл к вызову обработчиков).
+    Память постоянна, запись фронта не создаёт новых контейнеров - буфер можно держать включённым всегда.
+    Вызывается под edge_lock контроллера.
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.timestamps = array('d', bytes(8 * size))
+        self.levels = array('b', bytes(size))
+        self.survived = array('b', bytes(size))
+        self.count = 0
+
+    def record(self, timestamp, level):
+        """
+        Записывает фронт и возвращает его порядковый номер.
+        """
+        index = self.count % self.size
+        self.timestamps[index] = timestamp
+        self.levels[index] = level
+        self.survived[index] = 0
+        self.count += 1
+        return self.count - 1
+
+    def mark_survived(self, sequence):
+        if self.count - sequence <= self.size:
+            self.survived[sequence % self.size] = 1
+
+    def entries(self, pin, limit=None):
+        """
+        Возвращает записи от старых к новым в виде словарей (только для чтения через API).
+        """
+        available = min(self.count, self.size)
+        if limit is not None:
+            available = min(available, limit)
+        offset = time.time() - time.monotonic()
+        result = []
+        for sequence in range(self.count - available, self.count):
+            index = sequence % self.size
+            result.append({
+                "pin": pin,
+                "timestamp": self.timestamps[index],
+                "time": datetime.fromtimestamp(self.timestamps[index] + offset).isoformat(timespec="milliseconds"),
+                "level": self.levels[index],
+                "survived": bool(self.survived[index]),
+            })
+        return result
+
+
+def merged_history(limit=100):
+    """
+    Последние фронты всех пинов, упорядоченные по времени.
+    """
+    result = []
+    for controller in list(controllers.values()):
+        result.extend(controller.edge_history(limit))
+    result.sort(key=lambda entry: entry["timestamp"])
+    return result[-limit:]
+
+
+level_reader = None
+
+
+def take_snapshot(pins=None):
+    """
+    Читает уровни всех настроенных пинов (или pins) одним вызовом и возвращает PinSnapshot.
+    Обработчики не вызываются, state контроллеров не меняется.
+    """
+    global level_reader
+    if level_reader is None:
+        if not get_backend().hardware:
+            level_reader = InputLoopReader()
+        else:
+            try:
+                level_reader = GpioMemReader()
+            except Exception as e:
+                logger.info(f"Групповое чтение GPLEV0 недоступно ({str(e)}), используется чтение по пинам")
+                level_reader = InputLoopReader()
+    pins_mask = 0
+    for pin in (controllers if pins is None else pins):
+        pins_mask |= 1 << pin
+    return PinSnapshot(level_reader.read(pins_mask), pins_mask, time.monotonic())
+
+
+class Debouncer(threading.Thread):
+    """
+    Общий поток подавления дребезга для всех пинов. Обработчик фронта только запоминает время
+    и ставит пин в очередь проверки; здесь пин проверяется, когда после последнего фронта
+    прошло stable_time, и только тогда вызываются колбэки.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.condition = threading.Condition()
+        self.deadlines = []
+        self.sequence = 0
+
+    def schedule(self, controller, deadline):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.deadlines, (deadline, self.sequence, controller))
+            if self.deadlines[0][2] is controller:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.deadlines:
+                    self.condition.wait()
+                deadline, _, controller = self.deadlines[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self.condition.wait(deadline - now)
+                    continue
+                heapq.heappop(self.deadlines)
+            try:
+                next_deadline = controller.settle(now)
+            except Exception as e:
+                logger.error(f"Ошибка обработки пина {controller.pin}: {str(e)}")
+                next_deadline = None
+            if next_deadline is not None:
+                self.schedule(controller, next_deadline)
+
+
+debouncer = Debouncer()
+debouncer.start()
+
+
+class DispatchPool:
+    """
+    Пул потоков, выполняющих колбэки пинов, чтобы медленный обработчик не задерживал остальные пины.
+    У каждого пина своя очередь событий; пин, у которого есть события и которого сейчас никто
+    не обрабатывает, стоит в общей очереди готовых пинов. Свободный поток берёт следующий готовый
+    пин и выполняет одно его событие, поэтому события одного пина обрабатываются строго по порядку
+    и никогда параллельно, а медленный обработчик занимает только один поток и не держит чужие пины.
+
+    Политика переполнения (для каждого пина отдельно): если в очереди пина уже maxsize событий,
+    из неё выбрасывается самое старое (счётчик dropped общий и у пина), а новое ставится в конец -
+    последний уровень пина важнее устаревших. События других пинов при этом не теряются.
+    """
+
+    def __init__(self, workers=3, maxsize=16):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.ready = queue.Queue()  # контроллеры с необработанными событиями, каждый не больше одного раза
+        self.pending = {}  # пин -> deque событий
+        self.scheduled = set()  # пины в очереди готовых или в обработке
+        self.lock = threading.Lock()
+        self.dispatched = 0
+        self.dropped = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_last = 0.0
+        for _ in range(workers):
+            worker = threading.Thread(target=self.worker)
+            worker.daemon = True
+            worker.start()
+
+    def put(self, controller, level, edge_time):
+        event = (level, edge_time, time.monotonic())
+        with self.lock:
+            events = self.pending.get(controller.pin)
+            if events is None:
+                events = self.pending[controller.pin] = deque()
+            if len(events) >= self.maxsize:
+                events.popleft()
+                controller.dropped += 1
+                self.dropped += 1
+            events.append(event)
+            if controller.pin in self.scheduled:
+                return
+            self.scheduled.add(controller.pin)
+        self.ready.put(controller)
+
+    def worker(self):
+        while True:
+            controller = self.ready.get()
+            with self.lock:
+                level, edge_time, queued_at = self.pending[controller.pin].popleft()
+                lag = time.monotonic() - queued_at
+                self.dispatched += 1
+                self.lag_total += lag
+                self.lag_last = lag
+                if lag > self.lag_max:
+                    self.lag_max = lag
+            try:
+                controller.dispatch(level, edge_time)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика пина {controller.pin}: {str(e)}")
+            with self.lock:
+                if not self.pending[controller.pin]:
+                    self.scheduled.discard(controller.pin)
+                    continue
+            # следующее событие пина - в конец общей очереди, чтобы другие пины не ждали
+            self.ready.put(controller)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": {pin: len(events) for pin, events in sorted(self.pending.items()) if events},
+                "dispatched": self.dispatched,
+                "dropped": self.dropped,
+                "lag_ms": {
+                    "last": round(self.lag_last * 1000, 3),
+                    "max": round(self.lag_max * 1000, 3),
+                    "mean": round(self.lag_total / self.dispatched * 1000, 3) if self.dispatched else 0,
+                },
+            }
+
+
+dispatcher = DispatchPool()
+
+
+class ChatterMonitor(threading.Thread):
+    """
+    Отслеживает частоту установившихся переключений каждого пина: пачка дребезга после подавления
+    (уровень продержался stable_time) считается одним переключением, поэтому дребезг одного нажатия
+    карантин не вызывает. Пин, давший за окно window больше max_rate переключений в секунду
+    (неисправный геркон, контакт датчика), помещается в карантин: дребезг по-прежнему подавляется
+    и переключения считаются, но колбэки не вызываются, а уровень раз в sample_interval читается
+    опросом и передаётся обработчикам, только если изменился. Переключение, на котором сработал
+    карантин, ещё передаётся обработчикам. Пин возвращается в обычный режим, когда частота
+    calm_samples опросов подряд не выше calm_rate.
+
+    Переключения считаются до блокировки bouncetime. Для rpi, fake и poll пачку выделяет
+    PinController (poll видит только смены уровня между тактами опроса), для lgpio и pigpio
+    переключением является каждый фронт, переживший фильтр ядра или демона.
+    """
+
+    def __init__(self, window=1.0, max_rate=20, calm_rate=2, calm_samples=5, sample_interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.window = window
+        self.max_transitions = max_rate * window
+        self.calm_rate = calm_rate
+        self.calm_samples = calm_samples
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        self.quarantined = {}  # пин -> число спокойных опросов подряд
+        self.rates = {}
+        self.counts = {}
+        self.quarantine_counts = {}
+        self.events = deque(maxlen=100)
+
+    def quarantine(self, controller, transitions, now):
+        """
+        Вызывается из PinController.count_transition под edge_lock контроллера.
+        """
+        controller.quarantined = True
+        rate = round(transitions / max(now - controller.window_start, 0.001), 1)
+        with self.lock:
+            self.quarantined[controller.pin] = 0
+            self.quarantine_counts[controller.pin] = self.quarantine_counts.get(controller.pin, 0) + 1
+            self.events.append({"pin": controller.pin, "event": "quarantined", "rate": rate,
+                                "time": datetime.now().isoformat(timespec="seconds")})
+        logger.warning(f"Пин {controller.pin}: {rate} переключений/с, переведён на опрос раз в {self.sample_interval} с")
+
+    def restore(self, controller, rate):
+        with controller.edge_lock:
+            controller.quarantined = False
+            controller.window_start = time.monotonic()
+            controller.window_transitions = 0
+        with self.lock:
+            del self.quarantined[controller.pin]
+            self.events.append({"pin": controller.pin, "event": "restored", "rate": rate,
+                                "time": datetime.now().isoformat(timespec="seconds")})
+        logger.warning(f"Пин {controller.pin}: частота переключений {rate}/с, обычная обработка восстановлена")
+
+    def sample(self, elapsed):
+        for pin, controller in list(controllers.items()):
+            count = controller.transitions
+            rate = round((count - self.counts.get(pin, count)) / elapsed, 1)
+            self.counts[pin] = count
+            self.rates[pin] = rate
+            if not controller.quarantined:
+                continue
+            level = controller.backend.read(pin)
+            if level != controller.state:
+                dispatcher.put(controller, level, time.monotonic())
+            with self.lock:
+                calm = self.quarantined[pin] + 1 if rate <= self.calm_rate else 0
+                self.quarantined[pin] = calm
+            if calm >= self.calm_samples:
+                self.restore(controller, rate)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "quarantined": sorted(self.quarantined),
+                "rates": {pin: rate for pin, rate in sorted(self.rates.items()) if rate},
+                "quarantine_counts": dict(self.quarantine_counts),
+                "events": list(self.events),
+            }
+
+    def run(self):
+        last = time.monotonic()
+        while True:
+            time.sleep(self.sample_interval)
+            now = time.monotonic()
+            try:
+                self.sample(now - last)
+            except Exception as e:
+                logger.error(f"Ошибка опроса пинов в карантине: {str(e)}")
+            last = now
+
+
+chatter_monitor = ChatterMonitor()
+chatter_monitor.start()
+
+# верхние границы корзин гистограммы задержек фронт -> колбэк / запись реле, мс
+LATENCY_BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class EdgeLatency:
+    """
+    Задержки по пинам от времени фронта (отметка ядра или монотонные часы в момент получения фронта)
+    до начала колбэка (callback) и до записи в чип реле, выполненной колбэком (relay_write).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # (пин, этап) -> [число, сумма, максимум, последнее, корзины]
+
+    def record(self, pin, stage, latency):
+        with self.lock:
+            entry = self.entries.get((pin, stage))
+            if entry is None:
+                entry = self.entries[(pin, stage)] = [0, 0.0, 0.0, 0.0, [0] * (len(LATENCY_BUCKETS_MS) + 1)]
+            entry[0] += 1
+            entry[1] += latency
+            entry[2] = max(entry[2], latency)
+            entry[3] = latency
+            entry[4][bisect_left(LATENCY_BUCKETS_MS, latency * 1000)] += 1
+
+    def track_write(self, controller, futures):
+        """
+        Учитывает задержку фронт -> запись реле для Future (или списка Future) записи,
+        поставленной колбэком controller. Возвращает futures без изменений.
+        """
+        pin = controller.pin
+        edge_time = controller.edge_time
+        if edge_time is None:
+            return futures
+
+        def written(future):
+            written_at = getattr(future, "written_at", None)
+            if written_at is not None:
+                self.record(pin, "relay_write", written_at - edge_time)
+        for future in (futures if isinstance(futures, (list, tuple)) else (futures,)):
+            future.add_done_callback(written)
+        return futures
+
+    def stats(self):
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        result = {}
+        with self.lock:
+            for (pin, stage), (count, total, maximum, last, buckets) in sorted(self.entries.items()):
+                result.setdefault(pin, {})[stage] = {
+                    "count": count,
+                    "mean_ms": round(total / count * 1000, 3),
+                    "max_ms": round(maximum * 1000, 3),
+                    "last_ms": round(last * 1000, 3),
+                    "buckets": dict(zip(labels, buckets)),
+                }
+        return result
+
+
+edge_latency = EdgeLatency()
 
 
 class PinController:
 
     pin = None
     state = 0
+    role = None
+    edge_time = None  # время фронта, вызвавшего текущий колбэк (монотонные часы)
 
     def validate_pin(self, pin):
-        if not pin:
+        # 0 - допустимый номер BCM (GPIO0), как и в pin_map.validate_entry
+        if pin is None:
             raise Exception("Pin number expected.")
         if not isinstance(pin, str) and not isinstance(pin, int):
             raise Exception("Integer expected")
@@ -31,28 +466,119 @@ class PinController:
         logger.info("Check for {pin} pin".format(pin=self.pin))
 
     def handler(self, message):
-        time.sleep(0.01)
-        self.state = GPIO.input(self.pin)
+        self.dispatch(self.backend.read(self.pin), time.monotonic())
+
+    def dispatch(self, level, edge_time):
+        """
+        Вызывается потоком DispatchPool для установившегося уровня. Время фронта доступно
+        колбэкам как self.edge_time.
+        """
+        self.state = level
+        self.edge_time = edge_time
+        edge_latency.record(self.pin, "callback", time.monotonic() - edge_time)
         self.before_callback(self)
         if not self.state:
-            time.sleep(0.01)
-            self.state = GPIO.input(self.pin)
-            if not self.state:
-                self.callback(self)
+            self.callback(self)
+
+    def on_edge(self, level, timestamp):
+        # выполняется в потоке фронтов бэкенда: только запись фронта, без пауз
+        with self.edge_lock:
+            sequence = self.history.record(timestamp, level)
+            if self.backend.debounced:
+                # бэкенд уже выдержал stable_time: фронт - установившийся уровень, остаётся блокировка bouncetime
+                quarantined = self.quarantined
+                self.count_transition(timestamp)
+                if quarantined or timestamp - self.last_accepted < self.bouncetime:
+                    return
+                self.last_accepted = timestamp
+                self.last_edge = timestamp
+                self.last_edge_sequence = sequence
+                self.history.mark_survived(sequence)
+            else:
+                # каждый фронт продлевает ожидание: уровень читается через stable_time после последнего
+                self.last_edge = timestamp
+                self.last_edge_sequence = sequence
+                if self.settle_scheduled:
+                    return
+                self.settle_scheduled = True
+                self.burst_start = timestamp
+        if self.backend.debounced:
+            if self.pin != 22:
+                logger.info("Callback handler for pin {pin}".format(pin=self.pin))
+            dispatcher.put(self, level, timestamp)
+        else:
+            debouncer.schedule(self, timestamp + self.stable_time)
+
+    def settle(self, now):
+        """
+        Вызывается потоком Debouncer. Если после последнего фронта уровень держится stable_time,
+        читает его и ставит событие в пул обработчиков; иначе возвращает новый срок проверки.
+        Блокировка bouncetime применяется здесь, к установившемуся уровню: пачка фронтов, начавшаяся
+        раньше bouncetime после начала предыдущей переданной пачки, обработчикам не передаётся.
+        """
+        with self.edge_lock:
+            if now - self.last_edge < self.stable_time:
+                return self.last_edge + self.stable_time
+            self.settle_scheduled = False
+            # пачка закончилась: одно переключение; если на нём сработал карантин, оно ещё передаётся
+            quarantined = self.quarantined
+            self.count_transition(self.last_edge)
+            if quarantined or self.burst_start - self.last_accepted < self.bouncetime:
+                return None
+            self.last_accepted = self.burst_start
+            edge_time = self.last_edge
+            self.history.mark_survived(self.last_edge_sequence)
+        if self.pin != 22:
+            logger.info("Callback handler for pin {pin}".format(pin=self.pin))
+        dispatcher.put(self, self.backend.read(self.pin), edge_time)
+        return None
+
+    def count_transition(self, timestamp):
+        """
+        Учитывает установившееся переключение в окне ChatterMonitor (под edge_lock).
+        """
+        self.transitions += 1
+        if timestamp - self.window_start >= chatter_monitor.window:
+            self.window_start = timestamp
+            self.window_transitions = 0
+        self.window_transitions += 1
+        if not self.quarantined and self.window_transitions > chatter_monitor.max_transitions:
+            chatter_monitor.quarantine(self, self.window_transitions, timestamp)
 
-    def gpio_wrapper(self, pin):
-        if pin != 22:
-            logger.info("Callback handler for pin {pin}".format(pin=pin))
-        self.handler("Callback handler for pin {pin}".format(pin=pin))
+    def edge_history(self, limit=None):
+        with self.edge_lock:
+            return self.history.entries(self.pin, limit)
 
-    def __init__(self, pin, callback, up_down=GPIO.PUD_UP, react_on=GPIO.BOTH, before_callback=None, bouncetime=500):
+    def __init__(self, pin, callback, up_down=PUD_UP, react_on=BOTH, before_callback=None, bouncetime=500,
+                 stable_time=0.02):
         logger.info("Pin controller for {} pin has been initiated".format(pin))
         self.pin = self.validate_pin(pin)
-        assert (up_down in (GPIO.PUD_UP, GPIO.PUD_DOWN)), \
+        assert (up_down in (PUD_UP, PUD_DOWN)), \
             "This is weird! Pull-up-down parameter can be either UP or DOWN. {} given".format(up_down)
+        assert (react_on in (RISING, FALLING, BOTH)), \
+            "Edge can be either RISING, FALLING or BOTH. {} given".format(react_on)
         self.up_down = up_down
-        GPIO.setup(self.pin, GPIO.IN, pull_up_down=self.up_down)
+        self.backend = get_backend()
+        self.bouncetime = bouncetime / 1000
+        # уровень должен продержаться stable_time секунд после последнего фронта
+        self.stable_time = stable_time
+        self.edge_lock = threading.Lock()
+        self.last_edge = 0.0
+        self.settle_scheduled = False
+        self.burst_start = 0.0  # первый фронт текущей пачки дребезга
+        self.last_accepted = float("-inf")
+        self.history = EdgeHistory()
+        self.last_edge_sequence = 0
+        self.dropped = 0  # события этого пина, вытесненные при переполнении очереди
+        self.transitions = 0  # установившиеся переключения (пачка дребезга - одно)
+        self.window_start = 0.0
+        self.window_transitions = 0
+        self.quarantined = False
+        self.backend.setup_input(self.pin, self.up_down)
+        # уровень на момент запуска: до первого фронта state должен отражать вход, а не 0
+        self.state = self.backend.read(self.pin)
+        controllers[self.pin] = self
         self.callback = callback
         if before_callback:
             self.before_callback = before_callback
-        GPIO.add_event_detect(self.pin, react_on, self.gpio_wrapper, bouncetime=bouncetime)
+        self.backend.watch(self.pin, react_on, bouncetime, stable_time, self.on_edge)
@@ -0,0 +1,101 @@
+from gpio_backends import BOTH, FALLING, PUD_DOWN, PUD_UP, RISING
+from pin_controller import PinController
+
+PIN_COUNT = 28  # GPIO 0-27 в нумерации BCM
+
+PULLS = {"up": PUD_UP, "down": PUD_DOWN}
+EDGES = {"rising": RISING, "falling": FALLING, "both": BOTH}
+
+# Подключение комнаты - единственное место с разводкой. pin_map в config.json нужен только комнате
+# с другой разводкой и заменяет эту карту целиком.
+DEFAULT_PIN_MAP = [
+    {"pin": 1, "role": "switch_bedroom1_sconce_right", "handler": "f_switch_br",
+     "pull": "up", "edge": "falling", "bouncetime": 500},
+    {"pin": 7, "role": "window2", "handler": "f_window2", "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 8, "role": "fire_detector4", "handler": "f_fire_detector4",
+     "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 10, "role": "safe", "handler": "f_safe", "pull": "up", "edge": "falling", "bouncetime": 500},
+    {"pin": 12, "role": "switch_bedroom1_sconce_left", "handler": "f_switch_bl",
+     "pull": "up", "edge": "falling", "bouncetime": 500},
+    {"pin": 13, "role": "window3", "handler": "f_window3", "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 16, "role": "switch_bedroom1_main", "handler": "f_switch_main",
+     "pull": "up", "edge": "falling", "bouncetime": 500},
+    {"pin": 17, "role": "lighting_power", "handler": "f_energy_sensor",
+     "pull": "down", "edge": "rising", "bouncetime": 500},
+    {"pin": 18, "role": "mechanical_key", "handler": "f_using_key", "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 19, "role": "fire_detector2", "handler": "f_fire_detector2",
+     "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 20, "role": "window1_balcony", "handler": "f_window1", "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 21, "role": "flooding_sensor", "handler": "f_flooding_sensor",
+     "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 22, "role": "card_reader", "handler": "f_card_key", "before_handler": "cardreader_before",
+     "pull": "up", "edge": "falling", "bouncetime": 500},
+    {"pin": 23, "role": "door_lock_inside", "handler": "f_lock_door_from_inside",
+     "before_handler": "f_before_lock_door_from_inside",
+     "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 24, "role": "door_latch", "handler": "f_lock_latch", "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 25, "role": "fire_detector1", "handler": "f_fire_detector1",
+     "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 26, "role": "fire_detector3", "handler": "f_fire_detector3",
+     "pull": "up", "edge": "both", "bouncetime": 500},
+    {"pin": 27, "role": "circuit_breakers", "handler": "f_circuit_breaker",
+     "pull": "down", "edge": "rising", "bouncetime": 500},
+]
+
+
+class PinMapError(Exception):
+    pass
+
+
+def validate_entry(entry, handlers):
+    """
+    Проверяет одну запись карты пинов и возвращает аргументы PinController.
+    """
+    pin = entry.get("pin")
+    if not isinstance(pin, int) or isinstance(pin, bool) or not 0 <= pin < PIN_COUNT:
+        raise PinMapError(f"Pin map: pin must be an integer in [0; {PIN_COUNT - 1}], {pin!r} given")
+    handler = handlers.get(entry.get("handler"))
+    if handler is None:
+        raise PinMapError(f"Pin map: unknown handler {entry.get('handler')!r} for pin {pin}")
+    kwargs = {}
+    if "before_handler" in entry:
+        kwargs["before_callback"] = handlers.get(entry["before_handler"])
+        if kwargs["before_callback"] is None:
+            raise PinMapError(f"Pin map: unknown before_handler {entry['before_handler']!r} for pin {pin}")
+    pull = entry.get("pull", "up")
+    edge = entry.get("edge", "both")
+    if pull not in PULLS:
+        raise PinMapError(f"Pin map: pull must be one of {', '.join(PULLS)} for pin {pin}, {pull!r} given")
+    if edge not in EDGES:
+        raise PinMapError(f"Pin map: edge must be one of {', '.join(EDGES)} for pin {pin}, {edge!r} given")
+    kwargs["up_down"] = PULLS[pull]
+    kwargs["react_on"] = EDGES[edge]
+    kwargs["bouncetime"] = entry.get("bouncetime", 500)
+    if "stable_time" in entry:
+        kwargs["stable_time"] = entry["stable_time"]
+    return pin, handler, kwargs
+
+
+def compile_pin_map(entries, handlers):
+    """
+    Строит таблицу контроллеров по карте пинов из config.json: список длиной PIN_COUNT, индекс - номер
+    пина, для неиспользуемых пинов None. Каждая запись: pin, role, handler, before_handler (необязательно),
+    pull (up/down), edge (rising/falling/both), bouncetime (мс), stable_time (с, необязательно).
+    Имена обработчиков разрешаются через handlers (имя -> функция). Вся карта проверяется до создания
+    первого контроллера, поэтому ошибка в конфигурации не оставляет пины наполовину настроенными.
+    """
+    compiled = []
+    seen = set()
+    for entry in entries:
+        pin, handler, kwargs = validate_entry(entry, handlers)
+        if pin in seen:
+            raise PinMapError(f"Pin map: pin {pin} is listed more than once")
+        seen.add(pin)
+        compiled.append((pin, entry.get("role", f"pin{pin}"), handler, kwargs))
+
+    table = [None] * PIN_COUNT
+    for pin, role, handler, kwargs in compiled:
+        controller = PinController(pin, handler, **kwargs)
+        controller.role = role
+        table[pin] = controller
+    return table
@@ -1,111 +1,113 @@
-import RPi.GPIO as GPIO
+import sys
 import time
+import random
 import threading
 import logging
 
+from gpio_backends import BOTH, PUD_UP, FakeBackend, PollingBackend, RPiGPIOBackend
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class PinController:
-    def __init__(self, pin, pull_up=True, bounce_time=0.3):
-        self.pin = pin
-        self.pull_up = pull_up
-        self.bounce_time = bounce_time
-        self.last_state = None
-        self.callback = None
-        self.running = False
-        self.thread = None
-        
-        # Настройка GPIO
-        GPIO.setmode(GPIO.BCM)
-        if pull_up:
-            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        else:
-            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        
-        # Сохраняем начальное состояние
-        self.last_state = GPIO.input(pin)
-        
-        logger.info(f"Инициализирован пин GPIO{pin}, начальное состояние: {self.last_state}")
-    
-    def start_monitoring(self):
-        self.running = True
-        self.thread = threading.Thread(target=self._monitor_pin)
-        self.thread.daemon = True
-        self.thread.start()
-        logger.info(f"Мониторинг пина GPIO{self.pin} запущен")
-    
-    def stop_monitoring(self):
-        self.running = False
-        if self.thread:
-            self.thread.join(1.0)
-        logger.info(f"Мониторинг пина GPIO{self.pin} остановлен")
-    
-    def _monitor_pin(self):
-        last_time = time.time()
-        
-        while self.running:
-            current_state = GPIO.input(self.pin)
-            current_time = time.time()
-            
-            # Если состояние изменилось и прошло достаточно времени (для дребезга)
-            if current_state != self.last_state and (current_time - last_time) > self.bounce_time:
-                if self.callback:
-                    self.callback(self.pin, current_state)
-                logger.info(f"Изменение на пине GPIO{self.pin}: {current_state}")
-                
-                self.last_state = current_state
-                last_time = current_time
-            
-            # Небольшая задержка для уменьшения нагрузки на CPU
-            time.sleep(0.01)
-    
-    def set_callback(self, callback):
-        """Установить функцию обратного вызова при изменении состояния пина"""
-        self.callback = callback
-    
-    def read(self):
-        """Прочитать текущее состояние пина"""
-        return GPIO.input(self.pin)
-    
-    def cleanup(self):
-        """Освободить ресурсы"""
-        self.stop_monitoring()
-        # Не очищаем GPIO здесь, чтобы другие контроллеры могли использовать его
+# Опрос пинов одним потоком (PollingBackend) вместо потока на каждый пин.
+# python pin_test.py        - мониторинг пинов платы
+# python pin_test.py bench  - сравнение с потоком на пин на имитации GPIO (CPU и задержка обнаружения)
+
+PINS = [17, 27, 22, 10, 9, 11, 5, 6, 13, 19, 26]
+THREAD_POLL_INTERVAL = 0.01  # пауза прежнего потока на пин
+
 
 def pin_changed(pin, state):
     logger.info(f"Callback: Пин GPIO{pin} изменил состояние на {state}")
 
+
+def monitor(backend, pins, callback):
+    for pin in pins:
+        try:
+            backend.setup_input(pin, PUD_UP)
+            backend.watch(pin, BOTH, 0, 0, lambda level, timestamp, pin=pin: callback(pin, level))
+            logger.info(f"Пин GPIO{pin} успешно настроен, начальное состояние: {backend.read(pin)}")
+        except Exception as e:
+            logger.error(f"Ошибка при настройке пина GPIO{pin}: {str(e)}")
+
+
+def thread_per_pin(backend, pins, callback, running):
+    """
+    Прежняя схема для сравнения: поток на пин, чтение и пауза 10 мс.
+    """
+    def monitor_pin(pin):
+        last_state = backend.read(pin)
+        while running.is_set():
+            current_state = backend.read(pin)
+            if current_state != last_state:
+                callback(pin, current_state)
+                last_state = current_state
+            time.sleep(THREAD_POLL_INTERVAL)
+    for pin in pins:
+        backend.setup_input(pin, PUD_UP)
+        thread = threading.Thread(target=monitor_pin, args=(pin,))
+        thread.daemon = True
+        thread.start()
+
+
+def measure(name, start, fake, idle=5.0, changes=40):
+    detected = {}
+
+    def on_change(pin, level):
+        detected.setdefault(pin, time.monotonic())
+
+    start(on_change)
+    time.sleep(0.5)
+    cpu = time.process_time()
+    time.sleep(idle)
+    idle_cpu = (time.process_time() - cpu) / idle * 100
+
+    latencies = []
+    for _ in range(changes):
+        pin = random.choice(PINS)
+        detected.pop(pin, None)
+        injected = time.monotonic()
+        fake.inject(pin, 1 - fake.read(pin))
+        while pin not in detected and time.monotonic() - injected < 1.0:
+            time.sleep(0.0002)
+        if pin in detected:
+            latencies.append(detected[pin] - injected)
+        time.sleep(random.uniform(0.02, 0.6))
+    latencies.sort()
+    logger.info(f"{name}: потоков {threading.active_count()}, CPU в простое {idle_cpu:.2f}%, "
+                f"обнаружено {len(latencies)}/{changes}, задержка медиана {latencies[len(latencies) // 2] * 1000:.2f} мс, "
+                f"макс {latencies[-1] * 1000:.2f} мс")
+
+
+def bench():
+    logger.info(f"Сравнение на имитации GPIO, {len(PINS)} пинов")
+    fake = FakeBackend()
+    running = threading.Event()
+    running.set()
+    measure("Поток на пин", lambda callback: thread_per_pin(fake, PINS, callback, running), fake)
+    running.clear()
+    time.sleep(0.1)
+
+    fake = FakeBackend()
+    poller = PollingBackend(fake)
+    measure("Один поток опроса", lambda callback: monitor(poller, PINS, callback), fake)
+    logger.info(f"Такты опроса: {poller.stats()}")
+
+
 # Пример использования
 if __name__ == "__main__":
+    if sys.argv[1:] == ["bench"]:
+        bench()
+        sys.exit(0)
     try:
-        # Список пинов для тестирования
-        pins = [17, 27, 22, 10, 9, 11, 5, 6, 13, 19, 26]
-        controllers = []
-        
-        logger.info(f"Тестирование {len(pins)} пинов")
-        
-        for pin in pins:
-            try:
-                controller = PinController(pin)
-                controller.set_callback(pin_changed)
-                controller.start_monitoring()
-                controllers.append(controller)
-                logger.info(f"Пин GPIO{pin} успешно настроен")
-            except Exception as e:
-                logger.error(f"Ошибка при настройке пина GPIO{pin}: {str(e)}")
-        
+        logger.info(f"Тестирование {len(PINS)} пинов")
+        monitor(PollingBackend(RPiGPIOBackend()), PINS, pin_changed)
+
         # Даем время для работы мониторинга
         logger.info("Мониторинг запущен, нажмите Ctrl+C для завершения...")
         while True:
             time.sleep(1)
-            
+
     except KeyboardInterrupt:
         logger.info("Тестирование остановлено пользователем")
-    finally:
-        # Освобождаем ресурсы
-        for controller in controllers:
-            controller.cleanup()
-        GPIO.cleanup()
-        logger.info("GPIO освобождены")
\ No newline at end of file
@@ -1,19 +1,25 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
+import asyncio
 import threading
 import time
 import signal
-import smbus
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import pymssql
-import serial
-import RPi.GPIO as GPIO
 from retry import retry
 import logging
 import multiprocessing
 
-from pin_controller import PinController
-from relaycontroller import RelayController
+from i2c_bus import get_bus
+from i2c_discovery import require_devices
+from led_patterns import LedPatternEngine
+from pin_controller import chatter_monitor, dispatcher, edge_latency, get_backend, merged_history, take_snapshot
+from pin_map import DEFAULT_PIN_MAP, PIN_COUNT, compile_pin_map
+from relaycontroller import RelayBank, RelayController
+from relay_reconciler import RelayReconciler
+from rfid_reader import AsyncRfidReader, RfidReader
+from card_index import build_card_index, normalize_key
 from config import system_config, logger
 
 
@@ -77,7 +83,22 @@ door_just_closed = False
 can_open_the_door = False
 close_door_from_inside = False
 count_keys = 0
-room_controller = {}
+room_controller = [None] * PIN_COUNT  # контроллер по номеру пина, None - пин не используется
+room_pins = []  # используемые пины
+# "thread" - считыватель в своём потоке и цикл ожидания ключа в main(),
+# "asyncio" - считыватель и обработка ключей в цикле событий FastAPI
+key_executor = None
+if system_config.rfid_transport == "asyncio":
+    rfid_reader = AsyncRfidReader('/dev/ttyS0', 9600, frame_length=system_config.rfid_key_length,
+                                  repeat_window=system_config.rfid_repeat_window)
+    # цикл замка выполняется в одном своём потоке, а не в общем пуле цикла событий
+    key_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="card_key")
+else:
+    rfid_reader = RfidReader('/dev/ttyS0', 9600, frame_length=system_config.rfid_key_length,
+                             repeat_window=system_config.rfid_repeat_window)
+room_ready = False
+event_loop = None
+rfid_start_lock = threading.Lock()
 lighting_main = False  # переменная состояния основного света спальня1
 lighting_bl = False  # переменная состояния бра левый спальня1
 lighting_br = False  # переменная состояния бра правый спальня1
@@ -95,63 +116,78 @@ second_light_thread = None
 
 db_connection = None
 
-bus = smbus.SMBus(1)
+bus = get_bus(1)  # общий менеджер шины, используется и контроллерами реле
 
 
 def init_relay_controllers():
-    global relay1_controller, relay2_controller
+    global relay1_controller, relay2_controller, relay_bank, led_engine, relay_reconciler
     
     logger.info("Инициализация контроллеров реле...")
+
+    # оба расширителя должны отвечать, иначе останавливаемся с понятной ошибкой
+    require_devices(bus, (0x38, 0x39))
     
     # адреса контроллеров
-    relay1_controller = RelayController(0x38)  # PCA1
-    relay2_controller = RelayController(0x39)  # PCA2
+    # запись через очередь чипа: выключатели света не ждут импульсов замка и мигания светодиодов
+    relay1_controller = RelayController(0x38, async_writes=True)  # PCA1
+    relay2_controller = RelayController(0x39, async_writes=True)  # PCA2
+    # оба чипа как один регистр: логический бит = (адрес - 0x38) * 8 + бит чипа
+    relay_bank = RelayBank(bus, (relay1_controller, relay2_controller))
 
     # Маппинг для PCA1 (0x38)
     relay_logger.info("Настройка PCA1 (0x38):")
-    relay1_controller.set_bit(0)  # Открыть замок (K:IN1)
-    relay_logger.info("- Бит 0: Открыть замок (K:IN1)")
-    relay1_controller.set_bit(1)  # Закрыть замок (K:IN2)
-    relay_logger.info("- Бит 1: Закрыть замок (K:IN2)")
-    relay1_controller.clear_bit(2)  # Зеленый светодиод (X:7)
-    relay_logger.info("- Бит 2: Зеленый светодиод (X:7)")
-    relay1_controller.clear_bit(3)  # Синий светодиод (X:8)
-    relay_logger.info("- Бит 3: Синий светодиод (X:8)")
-    relay1_controller.clear_bit(4)  # Красный светодиод (X:9)
-    relay_logger.info("- Бит 4: Красный светодиод (X:9)")
-    relay1_controller.set_bit(5)  # Группа - R2 (силовое реле) (KG0)
-    relay_logger.info("- Бит 5: Группа - R2 (силовое реле) (KG0)")
+    with relay1_controller.transaction() as tx:
+        tx.set_bit(0)  # Открыть замок (K:IN1)
+        relay_logger.info("- Бит 0: Открыть замок (K:IN1)")
+        tx.set_bit(1)  # Закрыть замок (K:IN2)
+        relay_logger.info("- Бит 1: Закрыть замок (K:IN2)")
+        tx.clear_bit(2)  # Зеленый светодиод (X:7)
+        relay_logger.info("- Бит 2: Зеленый светодиод (X:7)")
+        tx.clear_bit(3)  # Синий светодиод (X:8)
+        relay_logger.info("- Бит 3: Синий светодиод (X:8)")
+        tx.clear_bit(4)  # Красный светодиод (X:9)
+        relay_logger.info("- Бит 4: Красный светодиод (X:9)")
+        tx.set_bit(5)  # Группа - R2 (силовое реле) (KG0)
+        relay_logger.info("- Бит 5: Группа - R2 (силовое реле) (KG0)")
 
     # Маппинг для PCA2 (0x39)
     relay_logger.info("Настройка PCA2 (0x39):")
-    relay2_controller.set_bit(0)  # Аварийное освещение (KG1:IN1)
-    relay_logger.info("- Бит 0: Аварийное освещение (KG1:IN1)")
-    relay2_controller.set_bit(1)  # Группа - R3 (свет) (KG1:IN2)
-    relay_logger.info("- Бит 1: Группа - R3 (свет) (KG1:IN2)")
-    relay2_controller.set_bit(2)  # Соленоиды (KG1:IN3)
-    relay_logger.info("- Бит 2: Соленоиды (KG1:IN3)")
-    relay2_controller.set_bit(4)  # Радиатор1 (KG2:IN1)
-    relay_logger.info("- Бит 4: Радиатор1 (KG2:IN1)")
-    relay2_controller.set_bit(5)  # Свет спальня1 (KG2:IN2)
-    relay_logger.info("- Бит 5: Свет спальня1 (KG2:IN2)")
-    relay2_controller.set_bit(6)  # Бра левый1 (KG2:IN3)
-    relay_logger.info("- Бит 6: Бра левый1 (KG2:IN3)")
-    relay2_controller.set_bit(7)  # Бра правый1 (KG2:IN4)
-    relay_logger.info("- Бит 7: Бра правый1 (KG2:IN4)")
-
-    data1 = bus.read_byte(0x38)
-    data2 = bus.read_byte(0x39)
+    with relay2_controller.transaction() as tx:
+        tx.set_bit(0)  # Аварийное освещение (KG1:IN1)
+        relay_logger.info("- Бит 0: Аварийное освещение (KG1:IN1)")
+        tx.set_bit(1)  # Группа - R3 (свет) (KG1:IN2)
+        relay_logger.info("- Бит 1: Группа - R3 (свет) (KG1:IN2)")
+        tx.set_bit(2)  # Соленоиды (KG1:IN3)
+        relay_logger.info("- Бит 2: Соленоиды (KG1:IN3)")
+        tx.set_bit(4)  # Радиатор1 (KG2:IN1)
+        relay_logger.info("- Бит 4: Радиатор1 (KG2:IN1)")
+        tx.set_bit(5)  # Свет спальня1 (KG2:IN2)
+        relay_logger.info("- Бит 5: Свет спальня1 (KG2:IN2)")
+        tx.set_bit(6)  # Бра левый1 (KG2:IN3)
+        relay_logger.info("- Бит 6: Бра левый1 (KG2:IN3)")
+        tx.set_bit(7)  # Бра правый1 (KG2:IN4)
+        relay_logger.info("- Бит 7: Бра правый1 (KG2:IN4)")
+
+    with bus.session():
+        data1 = bus.read_byte(0x38)
+        data2 = bus.read_byte(0x39)
     logger.info(f"Начальное состояние контроллеров: PCA1={bin(data1)}, PCA2={bin(data2)}")
 
+    # светодиоды PCA1: зеленый (X:7), синий (X:8), красный (X:9)
+    led_engine = LedPatternEngine(relay1_controller, bits=(2, 3, 4))
+    led_engine.start()
+
+    # ежесекундная сверка выходов чипов с кэшем (сброс расширителя, просадка питания)
+    relay_reconciler = RelayReconciler(bus, (relay1_controller, relay2_controller), interval=1)
+    relay_reconciler.start()
+
 
 
 
-active_cards = {}
+active_cards = {}  # канонический UID (card_index.normalize_key) -> строка таблицы карт
 logs = {}
 active_key = None
 
-GPIO.setmode(GPIO.BCM)
-
 close_door_from_inside_counter = 1
 open_door_counter = 1
 
@@ -169,34 +205,13 @@ def f_lock_door_from_inside(self):
 
 
 # GPIO_23 callback (проверка сработки внут защелки (ригеля) на закрытие)
-def f_lock_door_from_inside_thread():
-    logger.info("Lock door from inside thread")
-    while not bool(room_controller[23].state):
-        relay1_controller.set_bit(4)  # Красный светодиод (X:9)
-        time.sleep(0.2)
-        relay1_controller.clear_bit(4)  # Красный светодиод (X:9)
-        time.sleep(0.2)
-
-
-def f_open_door_indicates_thread():
-    logger.info("Open door indicates thread")
-    for i in range(12):
-        relay1_controller.set_bit(2)  # Зеленый светодиод (X:7)
-        time.sleep(0.2)
-        relay1_controller.clear_bit(2)  # Зеленый светодиод (X:7)
-        time.sleep(0.2)
-
-
 def f_before_lock_door_from_inside(self):
     logger.info("before lock door from inside")
-    global close_door_from_inside
-    time.sleep(0.01)
-    thread_time = threading.Thread(target=f_lock_door_from_inside_thread)
-    thread_time.start()
     if self.state:
         logger.info("Turn off red light")
-        thread_time.join()
-        relay1_controller.clear_bit(4)   # тушим красный светодиод
+        led_engine.cancel("lock_inside")  # тушим красный светодиод
+    else:
+        led_engine.start_pattern("lock_inside", 4, "blink")  # Красный светодиод (X:9), пока защелка открыта
 
 
 # GPIO_24 callback (проверка сработки "язычка" на открытие)
@@ -264,11 +279,13 @@ def timer_turn_everything_off(time_seconds):
 def turn_on(type = 1):
     global lighting_bl, lighting_br, lighting_main
     logger.info("Turn everything on")
-    relay1_controller.clear_bit(5)  # Соленоиды (KG1:IN3)
-    relay2_controller.clear_bit(2)  # Группа - R2 (KG0)
-    relay2_controller.clear_bit(1)  # Группа - R3 (свет) (KG1:IN2)
+    with relay_bank.transaction() as tx:
+        tx.clear_bit(RelayBank.bit(0x38, 5))  # Соленоиды (KG1:IN3)
+        tx.clear_bit(RelayBank.bit(0x39, 2))  # Группа - R2 (KG0)
+        tx.clear_bit(RelayBank.bit(0x39, 1))  # Группа - R3 (свет) (KG1:IN2)
     #if type == 1:
     #   start_timer(timer_turn_everything_off)
+    return tx.future
 
 
 # GPIO_22 callback картоприемник
@@ -283,7 +300,7 @@ def f_card_key(self):
             
             if card_role:
                 logger.info(f"Включение устройств для роли: {card_role}")
-                turn_on()
+                edge_latency.track_write(self, turn_on())
             else:
                 logger.info("Роль карты не определена")
         except Exception as e:
@@ -325,10 +342,10 @@ def f_switch_main(self):
     global lighting_main
     logger.info(f"Switch main {lighting_main}")
     if not lighting_main:
-        relay2_controller.clear_bit(5)  # Свет спальня1 (KG2:IN2)
+        edge_latency.track_write(self, relay2_controller.clear_bit(5))  # Свет спальня1 (KG2:IN2)
         lighting_main = True
     else:
-        relay2_controller.set_bit(5)  # Свет спальня1 (KG2:IN2)
+        edge_latency.track_write(self, relay2_controller.set_bit(5))  # Свет спальня1 (KG2:IN2)
         lighting_main = False
 
 
@@ -337,10 +354,10 @@ def f_switch_bl(self):
     global lighting_bl
     logger.info(f"switch bl {lighting_bl}")
     if not lighting_bl:
-        relay2_controller.clear_bit(6)  # Бра левый1 (KG2:IN3)
+        edge_latency.track_write(self, relay2_controller.clear_bit(6))  # Бра левый1 (KG2:IN3)
         lighting_bl = True
     else:
-        relay2_controller.set_bit(6)  # Бра левый1 (KG2:IN3)
+        edge_latency.track_write(self, relay2_controller.set_bit(6))  # Бра левый1 (KG2:IN3)
         lighting_bl = False
 
 
@@ -349,10 +366,10 @@ def f_switch_br(self):
     global lighting_br
     logger.info(f"Switch br {lighting_br}")
     if not lighting_br:
-        relay2_controller.clear_bit(7)  # Бра правый1 (KG2:IN4)
+        edge_latency.track_write(self, relay2_controller.clear_bit(7))  # Бра правый1 (KG2:IN4)
         lighting_br = True
     else:
-        relay2_controller.set_bit(7)  # Бра правый1 (KG2:IN4)
+        edge_latency.track_write(self, relay2_controller.set_bit(7))  # Бра правый1 (KG2:IN4)
         lighting_br = False
 
 
@@ -375,47 +392,32 @@ def cardreader_before(self):
     pass
 
 
+PIN_HANDLERS = {
+    handler.__name__: handler for handler in (
+        f_lock_door_from_inside, f_before_lock_door_from_inside, f_lock_latch, f_using_key, f_safe,
+        f_fire_detector1, f_fire_detector2, f_fire_detector3, f_fire_detector4, f_card_key, cardreader_before,
+        f_circuit_breaker, f_energy_sensor, f_window1, f_window2, f_window3,
+        f_switch_main, f_switch_bl, f_switch_br, f_flooding_sensor,
+    )
+}
+
+
 def init_room():
+    """
+    Создаёт контроллеры пинов по pin_map.DEFAULT_PIN_MAP; pin_map в config.json целиком её заменяет.
+    Возвращает таблицу, индексируемую номером пина (None для неиспользуемых пинов).
+    """
+    global room_pins
     logger.info("Init room")
-    pin_structure = {
-        0: None,
-        1: PinController(1, f_switch_br, react_on=GPIO.FALLING, bouncetime=500),
-        # кнопка-выключатель бра правый спальня1,
-        2: None,
-        3: None,
-        5: None,
-        6: None,
-        7: PinController(7, f_window2),  # (окно2)
-        8: PinController(8, f_fire_detector4),  # датчик дыма 4,
-        9: None,
-        10: PinController(10, f_safe, react_on=GPIO.FALLING),  # (сейф),
-        11: None,  # кнопка-выключатель бра правый спальня2,
-        12: PinController(12, f_switch_bl, react_on=GPIO.FALLING, bouncetime=500),
-        # кнопка-выключатель бра левый спальня1
-        13: PinController(13, f_window3),  # (окно3)
-        14: None,
-        15: None,
-        16: PinController(16, f_switch_main, react_on=GPIO.FALLING, bouncetime=500),
-        # кнопка-выключатель основного света спальня1
-        17: PinController(17, f_energy_sensor, up_down=GPIO.PUD_DOWN, react_on=GPIO.RISING),
-        # (контроль наличия питания R3 (освещения))
-        18: PinController(18, f_using_key),  # (открытие замка механическим ключем)
-        19: PinController(19, f_fire_detector2),  # (датчик дыма 2)
-        20: PinController(20, f_window1),  # (окно1-балкон)
-        21: PinController(21, f_flooding_sensor),  # (датчик затопления ВЩ)
-        22: PinController(22, f_card_key, react_on=GPIO.FALLING, up_down=GPIO.PUD_UP, before_callback=cardreader_before),  # картоприемник
-        23: PinController(23, f_lock_door_from_inside, before_callback=f_before_lock_door_from_inside),
-        # замок "запрет"
-        24: PinController(24, f_lock_latch),  # замок сработка "язычка"
-        25: PinController(25, f_fire_detector1),  # датчик дыма 1
-        26: PinController(26, f_fire_detector3),  # датчик дыма 3
-        27: PinController(27, f_circuit_breaker, up_down=GPIO.PUD_DOWN, react_on=GPIO.RISING),
-        # (цепь допконтактов автоматов)
-    }
-
-    global bus
-    logger.info("The room has been initiated")
-    return pin_structure
+    pin_map = system_config.pin_map
+    if pin_map is None:
+        logger.info("В config.json нет pin_map, используется DEFAULT_PIN_MAP")
+        pin_map = DEFAULT_PIN_MAP
+    pin_table = compile_pin_map(pin_map, PIN_HANDLERS)
+    room_pins = [pin for pin, controller in enumerate(pin_table) if controller]
+    logger.info("The room has been initiated: " +
+                ", ".join(f"{pin}:{pin_table[pin].role}" for pin in room_pins))
+    return pin_table
 
 
 def get_card_role(card):
@@ -463,29 +465,23 @@ def permit_open_door():
     logger.info(f"Card role after all: {card_role}")
     if is_door_locked_from_inside() and card_role != "Admin":
         logger.info("The door has been locked by the guest.")
-        for i in range(10):
-            relay1_controller.set_bit(2)  # Зеленый светодиод (X:7)
-            time.sleep(0.2)
-            relay1_controller.clear_bit(2)  # Зеленый светодиод (X:7)
-            time.sleep(0.2)
+        led_engine.start_pattern("door_locked", 2, "blink", repeat=10)  # Зеленый светодиод (X:7)
     else:
         logger.info("Can open the door")
         can_open_the_door = True
-        thread_time = threading.Thread(target=f_open_door_indicates_thread)
-        thread_time.start()
+        led_engine.start_pattern("open_door", 2, "blink", repeat=12)  # Зеленый светодиод (X:7)
 
-        relay1_controller.clear_bit(1)  # Закрыть замок (K:IN2)
-        time.sleep(0.115)
-        relay1_controller.set_bit(1)  # Закрыть замок (K:IN2)
+        pulse_width = relay1_controller.pulse(1, system_config.lock_pulse_width).result()  # Закрыть замок (K:IN2)
+        relay_logger.info(f"Импульс замка K:IN2: {pulse_width * 1000:.1f} мс")
         #second_light_thread = multiprocessing.Process(target=second_light_control)
         #second_light_thread.start()
         time.sleep(4.25)
-        close_door(thread_time)
+        close_door()
 
 
 # закрытие замка, с предварительной проверкой
 @retry(tries=10, delay=1)
-def close_door(thread_time=None):
+def close_door():
     global door_just_closed, can_open_the_door
     if not can_open_the_door:
         logger.info("Door is closed. Permission denied!")  # ????
@@ -493,19 +489,12 @@ def close_door(thread_time=None):
     can_open_the_door = False
     door_just_closed = True
     time.sleep(0.1)
-    relay1_controller.clear_bit(0)  # Открыть замок (K:IN1)
-    time.sleep(0.115)
-    relay1_controller.set_bit(0)  # Открыть замок (K:IN1)
-    if thread_time:
-        thread_time.join()
+    pulse_width = relay1_controller.pulse(0, system_config.lock_pulse_width).result()  # Открыть замок (K:IN1)
+    relay_logger.info(f"Импульс замка K:IN1: {pulse_width * 1000:.1f} мс")
     #relay1_controller.clear_bit(2)  # Зеленый светодиод (X:7)
     logger.info("Client has been entered!")
 
 
-def handle_table_row(row_):
-    return row_[system_config.rfig_key_table_index].replace(" ", "")
-
-
 def get_db_connection():
     global db_connection
     if db_connection is None:
@@ -517,17 +506,18 @@ def get_db_connection():
 def turn_everything_off():
     global lighting_bl, lighting_br, lighting_main, is_sold
     logger.info("Turn everything off !")
-    relay2_controller.set_bit(2)  # Соленоиды (KG1:IN3)
-    if not is_sold:
-        relay1_controller.set_bit(5)  # Группа - R2 (KG0)
-    relay2_controller.set_bit(1)  # Группа - R3 (свет) (KG1:IN2)
-    relay2_controller.set_bit(6)  # Бра левый1 (KG2:IN3)
-    relay2_controller.set_bit(7)  # Бра правый1 (KG2:IN4)
+    with relay_bank.transaction() as tx:
+        if not is_sold:
+            tx.set_bit(RelayBank.bit(0x38, 5))  # Группа - R2 (KG0)
+        tx.set_bit(RelayBank.bit(0x39, 2))  # Соленоиды (KG1:IN3)
+        tx.set_bit(RelayBank.bit(0x39, 1))  # Группа - R3 (свет) (KG1:IN2)
+        tx.set_bit(RelayBank.bit(0x39, 6))  # Бра левый1 (KG2:IN3)
+        tx.set_bit(RelayBank.bit(0x39, 7))  # Бра правый1 (KG2:IN4)
+        tx.set_bit(RelayBank.bit(0x39, 5))  # Свет спальня1 (KG2:IN2)
+        tx.set_bit(RelayBank.bit(0x39, 4))  # Радиатор1 (KG2:IN1)
     lighting_br = False
     lighting_bl = False
     lighting_main = False
-    relay2_controller.set_bit(5)  # Свет спальня1 (KG2:IN2)
-    relay2_controller.set_bit(4)  
 
 @retry(tries=3, delay=1)
 def get_active_cards():
@@ -541,7 +531,8 @@ def get_active_cards():
 
 
     # key_list = [(301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2021, 2, 18, 14, 33, 25), None, 1), (301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2021, 8, 24, 10, 43, 18), None, 1), (301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2021, 8, 24, 10, 43, 22), None, 1), (301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2021, 8, 24, 12, 16, 44), None, 1), (301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2021, 8, 24, 11, 55, 42), None, 1), (301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2023, 5, 24, 14, 31, 51), None, 1), (301, '3D 00 4B 90 5E                  ', datetime.datetime(2017, 6, 7, 21, 0), datetime.datetime(2299, 1, 1, 0, 0), True, 9, datetime.datetime(2023, 5, 24, 14, 31, 53), None, 1), (301, '21 00 36 BD A2                  ', datetime.datetime(2023, 6, 6, 21, 0), datetime.datetime(2025, 6, 19, 0, 0), True, 26, datetime.datetime(2023, 6, 30, 13, 9, 57), None, 1), (301, '21 00 37 C9 F5                  ', datetime.datetime(2023, 7, 31, 21, 0), datetime.datetime(2024, 8, 3, 0, 0), True, 3, datetime.datetime(2023, 8, 3, 11, 51, 44), None, 1), (301, '21 00 37 C9 F5                  ', datetime.datetime(2023, 7, 31, 21, 0), datetime.datetime(2024, 8, 3, 0, 0), True, 3, datetime.datetime(2023, 8, 3, 11, 51, 47), None, 1), (301, '21 00 37 C9 F5                  ', datetime.datetime(2023, 7, 31, 21, 0), datetime.datetime(2024, 8, 3, 0, 0), True, 0, datetime.datetime(2023, 8, 3, 11, 48, 27), None, 1), (301, '21 00 37 C9 F5                  ', datetime.datetime(2023, 7, 31, 21, 0), datetime.datetime(2024, 8, 3, 0, 0), True, 2, datetime.datetime(2023, 8, 3, 11, 48, 50), None, 1)]
-    active_cards = {handle_table_row(key): key for key in key_list}
+    # новый индекс строится целиком и подменяет старый одним присваиванием
+    active_cards = build_card_index(key_list, system_config.rfig_key_table_index)
 
 
 
@@ -580,47 +571,26 @@ def get_active_cards():
 
 
 
-@retry(tries=10, delay=1)
-def wait_rfid():
+def wait_rfid(timeout=2):
+    """
+    Ждёт ключ от постоянно работающего считывателя RFID не дольше timeout секунд.
+    """
     logger.info("Ожидание карты RFID...")
-    try:
-        # Увеличиваем таймаут
-        rfid_port = serial.Serial('/dev/ttyS0', 9600, timeout=2)
-        
-        # Очищаем буфер перед чтением
-        rfid_port.flushInput()
-        
-        # Получаем все доступные данные
-        read_byte = rfid_port.read(system_config.rfid_key_length)
-        
-        # Декодируем только если данные не пустые
-        if read_byte:
-            key_ = read_byte.decode("utf-8")
-            card_logger.info(f"Карта обнаружена: {key_} в {datetime.utcnow()}")
-            rfid_port.close()
-            return key_
-        else:
-            logger.warning("Карта не считана")
-            rfid_port.close()
-            return None
-    except Exception as e:
-        logger.error(f"Ошибка при чтении RFID: {str(e)}")
-        try:
-            rfid_port.close()
-        except:
-            pass
+    read = rfid_reader.get(timeout)
+    if read is None:
         return None
+    card_logger.info(f"Карта обнаружена: {read.key} в {datetime.utcnow()}, "
+                     f"считывание {(read.received_at - read.first_byte_at) * 1000:.1f} мс")
+    return read.key
 
 
 @retry(tries=3, delay=5)
 def check_pins():
-    global room_controller
-    pin_list_for_check = [1, 7, 8, 10, 12, 13, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27]
-    for item in pin_list_for_check:
-        room_controller[item].check_pin()
+    # один групповой снимок уровней, без вызова обработчиков
+    snapshot = take_snapshot(room_pins)
     state_message = "Pin state : "
-    for item in pin_list_for_check:
-        state_message += "pin#{pin}:{state}, ".format(pin=room_controller[item].pin, state=room_controller[item].state)
+    for item in room_pins:
+        state_message += "pin#{pin}:{state}, ".format(pin=item, state=snapshot.level(item))
     logger.info(f"State: {state_message}")
 
 
@@ -703,19 +673,72 @@ def read_root():
 
 @app.get('/get_input/')
 async def get_input():
-    global room_controller
+    snapshot = take_snapshot()
     states = []
-    for i in range(27):
-        try:
-            states.append({"pin" + str(i): "state = " + str(bool(room_controller[i].state))})
-        except Exception:
-            pass
+    for i in range(28):
+        if (snapshot.pins_mask >> i) & 1:
+            states.append({"pin" + str(i): "state = " + str(bool(snapshot.level(i)))})
 
 
     return states
 
 
 
+@app.get('/relays/')
+async def get_relays():
+    states = {}
+    for controller in (relay1_controller, relay2_controller):
+        states[hex(controller.get_address())] = {"state": bin(controller.get_state())}
+    for address, stats in relay_reconciler.stats().items():
+        states[address].update(stats)
+    return states
+
+
+@app.get('/i2c_stats/')
+async def get_i2c_stats():
+    return bus.stats.snapshot()
+
+
+@app.get('/gpio_stats/')
+async def get_gpio_stats():
+    stats = dispatcher.stats()
+    backend = get_backend()
+    stats["backend"] = backend.name
+    if backend.name == "poll":
+        stats["poll"] = backend.stats()
+    stats["dropped_by_pin"] = {pin: controller.dropped for pin, controller in enumerate(room_controller)
+                               if controller and controller.dropped}
+    return stats
+
+
+@app.get('/rfid_stats/')
+async def get_rfid_stats():
+    return rfid_reader.stats()
+
+
+@app.get('/pins/latency/')
+async def get_pins_latency():
+    return edge_latency.stats()
+
+
+@app.get('/pins/chatter/')
+async def get_pins_chatter():
+    return chatter_monitor.stats()
+
+
+@app.get('/pins/history/')
+async def get_pins_history(limit: int = 100):
+    return merged_history(limit)
+
+
+@app.get('/pins/{pin}/history/')
+async def get_pin_history(pin: int, limit: int = 100):
+    controller = room_controller[pin] if 0 <= pin < PIN_COUNT else None
+    if not controller:
+        return {'error': f'Pin {pin} is not configured'}
+    return controller.edge_history(limit)
+
+
 @app.get('/logs/')
 async def get_logs(request: Request):
     log_file = 'debug.log'  # Укажите имя вашего файла с логами
@@ -733,10 +756,11 @@ async def get_logs(request: Request):
 prev_card_present = True
 def cardreader_find():
     global is_empty, timer_thread, off_timer_thread, prev_card_present, second_light_thread
-    card_present = not GPIO.input(22)
+    card_present = not get_backend().read(22)
     #print("Карта GPIO ",  card_present)
-    data1 = bus.read_byte(0x38)
-    data2 = bus.read_byte(0x39)
+    with bus.session():
+        data1 = bus.read_byte(0x38)
+        data2 = bus.read_byte(0x39)
 
     card_logger.debug(f"Состояние контроллеров: PCA1={bin(data1)}, PCA2={bin(data2)}")
     card_logger.debug(f"Состояние реле1: {bin(relay1_controller.get_state())}")
@@ -770,8 +794,62 @@ def cardreader_find():
 
 
 
+def handle_entered_key(entered_key):
+    global door_just_closed, active_key
+    door_just_closed = False
+    card = active_cards.get(normalize_key(entered_key))
+    if card is not None:
+        active_key = card
+        card_role = get_card_role(active_key)
+        logger.info(f"Обнаружен корректный ключ, роль: {card_role} {entered_key}")
+        logger.info("Открытие двери...")
+        # пока идёт цикл замка, повторные считывания этой карты отбрасываются
+        with rfid_reader.door_cycle(entered_key):
+            permit_open_door()
+    else:
+        logger.warning(f"Обнаружен неизвестный ключ: {entered_key}")
+        logger.info("Сигнализация о неизвестном ключе...")
+        led_engine.start_pattern("unknown_key", 4, "fast_blink", repeat=15, priority=1)  # Красный светодиод (X:9)
+
+
+async def card_events():
+    """
+    Обработка ключей в цикле событий (rfid_transport = "asyncio"). Чтение порта и очередь
+    ключей работают в цикле без потоков; цикл замка с паузами и синхронными импульсами
+    выполняется в key_executor (один поток, создаётся при первом ключе), чтобы не останавливать
+    HTTP на 4 с. Ключи обрабатываются строго по одному, как в прежнем цикле main().
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        read = await rfid_reader.get()
+        card_logger.info(f"Карта обнаружена: {read.key} в {datetime.utcnow()}, "
+                         f"считывание {(read.received_at - read.first_byte_at) * 1000:.1f} мс")
+        try:
+            await loop.run_in_executor(key_executor, handle_entered_key, read.key)
+        except Exception as e:
+            logger.error(f"Ошибка обработки ключа {read.key}: {str(e)}")
+
+
+def start_async_rfid(ready=False, loop=None):
+    """
+    Запускает асинхронный считыватель, когда комната инициализирована (ready, из main)
+    и известен цикл событий (loop, из startup FastAPI) - в каком бы порядке это ни произошло.
+    """
+    global room_ready, event_loop
+    with rfid_start_lock:
+        room_ready = room_ready or ready
+        event_loop = event_loop or loop
+        if not (room_ready and event_loop):
+            return
+
+    def start():
+        rfid_reader.start(event_loop)
+        event_loop.create_task(card_events())
+    event_loop.call_soon_threadsafe(start)
+
+
 def main():
-    global room_controller, door_just_closed, active_key
+    global room_controller
     
     try:
         logger.info("=== ЗАПУСК СИСТЕМЫ УПРАВЛЕНИЯ КОМНАТОЙ ===")
@@ -817,28 +895,21 @@ def main():
         logger.info("Устройства включены")
         
         logger.info("=== СИСТЕМА ГОТОВА К РАБОТЕ ===")
-        
+
+        if system_config.rfid_transport == "asyncio":
+            # ключи обрабатывает цикл событий FastAPI (card_events), поток main больше не нужен
+            start_async_rfid(ready=True)
+            return
+
+        # Считыватель RFID держит порт открытым и собирает ключи в очередь
+        rfid_reader.start()
+
         # Основной цикл
         while True:
             logger.info("Ожидание ключа...")
-            door_just_closed = False
-            
             entered_key = wait_rfid()
             if entered_key:
-                if entered_key in list(active_cards.keys()):
-                    active_key = active_cards[entered_key]
-                    card_role = get_card_role(active_key)
-                    logger.info(f"Обнаружен корректный ключ, роль: {card_role} {entered_key}")
-                    logger.info("Открытие двери...")
-                    permit_open_door()
-                else:
-                    logger.warning(f"Обнаружен неизвестный ключ: {entered_key}")
-                    logger.info("Сигнализация о неизвестном ключе...")
-                    for i in range(15):
-                        relay1_controller.set_bit(4)  # Красный светодиод (X:9)
-                        time.sleep(0.1)
-                        relay1_controller.clear_bit(4)  # Красный светодиод (X:9)
-                        time.sleep(0.1)
+                handle_entered_key(entered_key)
             
     except ProgramKilled:
         logger.info("Получен сигнал завершения программы, очистка...")
@@ -854,6 +925,8 @@ def main():
 async def on_startup():
     print("Starting server...")
     logging.basicConfig()
+    if system_config.rfid_transport == "asyncio":
+        start_async_rfid(loop=asyncio.get_running_loop())
     print("Server started")
 
 thread = threading.Thread(target=main)
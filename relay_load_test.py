@@ -0,0 +1,149 @@
+import random
+import sys
+import threading
+import time
+import timeit
+
+import relaycontroller
+from config import logger
+from i2c_bus import register_bus
+from relaycontroller import RelayController
+
+# Проверка RelayController на имитации шины I2C (Raspberry Pi и чипы не нужны).
+# python relay_load_test.py bench   - стоимость операций с состоянием (set/clear/toggle/check/get)
+# python relay_load_test.py stress  - параллельные set/clear/toggle из многих потоков, проверка итоговой маски
+
+OPERATIONS = 200000
+THREADS = 8
+UPDATES_PER_THREAD = 2500
+
+
+class MemoryBus:
+    """
+    Имитация smbus.SMBus: запоминает последнее записанное в каждый чип значение.
+    """
+
+    def __init__(self, yield_gil=False):
+        self.latch = {}
+        self.writes = 0
+        self.yield_gil = yield_gil
+        self.in_flight = 0
+        self.overlapped = 0
+
+    def write_byte_data(self, address, register, value):
+        self.in_flight += 1
+        if self.in_flight > 1:
+            self.overlapped += 1
+        if self.yield_gil:
+            time.sleep(0)  # настоящий ioctl отпускает GIL посреди записи
+        self.latch[address] = value
+        self.writes += 1
+        self.in_flight -= 1
+
+    def read_byte(self, address):
+        return self.latch.get(address, 0xFF)
+
+
+def quiet():
+    # вывод в консоль на каждую операцию дороже самой операции и измерял бы терминал
+    relaycontroller.print = lambda *args, **kwargs: None
+
+
+def per_op(stmt, setup="pass", number=OPERATIONS, globals=None):
+    return min(timeit.repeat(stmt, setup=setup, number=number, repeat=5, globals=globals)) / number
+
+
+def bench():
+    quiet()
+    device = MemoryBus()
+    controller = RelayController(0x38, bus=register_bus(1, device))
+    logger.info(f"Операции RelayController (запись в имитацию шины, delay=0), {OPERATIONS} повторов")
+    for name, stmt in (("set_bit", lambda: controller.set_bit(3, delay=0)),
+                       ("clear_bit", lambda: controller.clear_bit(3, delay=0)),
+                       ("toggle_bit", lambda: controller.toggle_bit(3, delay=0)),
+                       ("check_bit", lambda: controller.check_bit(3)),
+                       ("get_state", controller.get_state)):
+        logger.info(f"{name:10s} {per_op(stmt) * 1e6:7.3f} мкс")
+
+    # только работа с состоянием: прежняя строка '11111111' против целого числа
+    number = OPERATIONS * 5
+    as_string = per_op("l = list(s); l[7 - 3] = '1'; s = ''.join(l); int(s, 2)", "s = '11110111'", number)
+    as_int = per_op("s = s | (1 << 3)", "s = 0xF7", number)
+    logger.info(f"Установка бита в состоянии: строка {as_string * 1e9:.0f} нс, число {as_int * 1e9:.0f} нс")
+    get_string = per_op("int(s, 2)", "s = '11111011'", number)
+    logger.info(f"Чтение состояния: строка -> int {get_string * 1e9:.0f} нс, число - без преобразования")
+
+
+def stress_one(bus_num, async_writes):
+    """
+    Каждый поток меняет свой бит случайными set/clear/toggle и сам считает его итоговое значение.
+    Потерянное обновление дало бы расхождение кэша или чипа с ожидаемой маской,
+    а пропущенная запись - меньшее число записей в шину.
+    """
+    device = MemoryBus(yield_gil=True)
+    controller = RelayController(0x38, bus=register_bus(bus_num, device), async_writes=async_writes)
+    expected = [1] * THREADS  # после инициализации все биты установлены
+
+    def worker(bit):
+        rng = random.Random(bit)
+        for _ in range(UPDATES_PER_THREAD):
+            operation = rng.randrange(3)
+            if operation == 0:
+                controller.set_bit(bit, delay=0)
+                expected[bit] = 1
+            elif operation == 1:
+                controller.clear_bit(bit, delay=0)
+                expected[bit] = 0
+            else:
+                controller.toggle_bit(bit, delay=0)
+                expected[bit] ^= 1
+
+    threads = [threading.Thread(target=worker, args=(bit,)) for bit in range(THREADS)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # пустое применение встаёт в очередь последним: после него все записи дошли до чипа
+    controller.apply(delay=0).result()
+    elapsed = time.monotonic() - started
+
+    mask = sum(value << bit for bit, value in enumerate(expected))
+    updates = THREADS * UPDATES_PER_THREAD
+    mode = "асинхронно" if async_writes else "синхронно"
+    logger.info(f"{mode}: {updates} обновлений за {elapsed:.2f} с, ожидается {mask:08b}, кэш {controller.get_state():08b}, "
+                f"чип {device.latch[0x38]:08b}, записей {device.writes}, одновременных записей {device.overlapped}")
+    failures = []
+    if controller.get_state() != mask:
+        failures.append("кэш не совпадает с ожидаемой маской")
+    if device.latch[0x38] != mask:
+        failures.append("состояние чипа не совпадает с ожидаемой маской")
+    # инициализация + обновления + завершающее применение
+    if device.writes != updates + 2:
+        failures.append(f"записей {device.writes}, ожидалось {updates + 2}")
+    if device.overlapped:
+        failures.append("записи в шину пересеклись")
+    if controller.has_pending_writes():
+        failures.append("остались незаписанные изменения")
+    for failure in failures:
+        logger.error(f"{mode}: {failure}")
+    return not failures
+
+
+def stress():
+    quiet()
+    # короткий квант переключения потоков, чтобы гонки проявлялись чаще
+    sys.setswitchinterval(1e-6)
+    logger.info(f"Параллельные обновления: {THREADS} потоков по {UPDATES_PER_THREAD} операций")
+    # разные номера шин, чтобы у асинхронного контроллера была своя очередь записи
+    results = [stress_one(1, False), stress_one(2, True)]
+    return all(results)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["bench"]:
+        bench()
+    elif sys.argv[1:] == ["stress"]:
+        sys.exit(0 if stress() else 1)
+    else:
+        print("Запуск: python relay_load_test.py bench|stress")
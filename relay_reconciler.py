@@ -0,0 +1,67 @@
+import threading
+
+from config import logger
+
+
+class RelayReconciler(threading.Thread):
+    """
+    Периодически сверяет выходы PCA-чипов с кэшированным состоянием контроллеров реле.
+    Все чипы читаются за один захват шины; расхождение исправляется одной записью
+    кэшированного состояния, а случаи дрейфа считаются по каждому чипу.
+    Чипы с ещё не записанными изменениями в этом проходе пропускаются.
+    """
+
+    def __init__(self, bus, controllers, interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stopped = threading.Event()
+        self.bus = bus
+        self.controllers = controllers
+        self.interval = interval
+        self.drift_events = {controller.get_address(): 0 for controller in controllers}
+        self.last_read = {}
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def reconcile(self):
+        """
+        Один проход сверки. Возвращает список контроллеров, состояние которых было восстановлено.
+        """
+        drifted = []
+        with self.bus.session():
+            for controller in self.controllers:
+                if controller.has_pending_writes():
+                    continue
+                address = controller.get_address()
+                expected = controller.get_state()
+                actual = self.bus.read_byte(address)
+                self.last_read[address] = actual
+                # кэш мог измениться во время чтения - тогда сравнивать не с чем
+                if actual != expected and not controller.has_pending_writes() and controller.get_state() == expected:
+                    drifted.append((controller, expected, actual))
+        # запись выполняется после освобождения шины, чтобы не держать её дольше одного прохода
+        for controller, expected, actual in drifted:
+            address = controller.get_address()
+            self.drift_events[address] += 1
+            logger.warning(f"Расхождение состояния контроллера {hex(address)}: "
+                           f"ожидалось {expected:08b}, прочитано {actual:08b}. Восстановление...")
+            controller.resync()
+        return [controller for controller, _, _ in drifted]
+
+    def stats(self):
+        return {
+            hex(address): {
+                "drift_events": count,
+                "last_read": self.last_read.get(address),
+            }
+            for address, count in self.drift_events.items()
+        }
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Ошибка сверки состояния реле: {str(e)}")
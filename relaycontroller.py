@@ -1,72 +1,438 @@
-import smbus
+import collections
+import queue
+import threading
 import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from i2c_bus import get_bus
+
+
+class RelayTransaction:
+    """
+    Набор изменений битов, которые будут записаны в контроллер одной командой.
+    """
+
+    def __init__(self):
+        self.set_mask = 0
+        self.clear_mask = 0
+        self.future = None  # Future записи, доступен после выхода из блока with
+
+    def set_bit(self, bit):
+        self.set_mask |= 1 << bit
+        self.clear_mask &= ~(1 << bit)
+
+    def clear_bit(self, bit):
+        self.clear_mask |= 1 << bit
+        self.set_mask &= ~(1 << bit)
+
+
+PULSE_SPIN_MARGIN = 0.002  # последние 2 мс импульса ждём активным опросом часов
+
+
+def write_pulse(bus, address, active_state, idle_state, width):
+    """
+    Записывает active_state, удерживает его width секунд по монотонным часам и возвращает idle_state.
+    Основную часть интервала поток спит, последние PULSE_SPIN_MARGIN секунд опрашивает часы,
+    чтобы не зависеть от точности пробуждения планировщика.
+    Возвращает измеренную длительность импульса (между завершением двух записей).
+    """
+    bus.write_byte_data(address, 0x09, active_state)
+    started = time.monotonic()
+    deadline = started + width
+    remaining = deadline - started - PULSE_SPIN_MARGIN
+    if remaining > 0:
+        time.sleep(remaining)
+    while time.monotonic() < deadline:
+        pass
+    bus.write_byte_data(address, 0x09, idle_state)
+    return time.monotonic() - started
+
+
+class RelayWriteQueue(threading.Thread):
+    """
+    Очередь записи для одного PCA-чипа. Единственный поток пишет состояния в порядке
+    поступления и выдерживает время установки реле (delay) между записями.
+    """
+
+    def __init__(self, bus, address):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.bus = bus
+        self.address = address
+        self.queue = queue.Queue()
+        self.start()
+
+    def put(self, state, delay, done=None):
+        """
+        Ставит состояние в очередь. Future завершается после записи и паузы delay;
+        future.written_at - время записи в чип по монотонным часам.
+        done (если задан) вызывается сразу после попытки записи, до паузы.
+        """
+        future = Future()
+
+        def job():
+            try:
+                self.bus.write_byte_data(self.address, 0x09, state)
+                future.written_at = time.monotonic()
+            finally:
+                if done:
+                    done()
+            if delay:
+                time.sleep(delay)
+            return state
+        return self.put_job(job, future)
+
+    def put_job(self, job, future=None):
+        """
+        Ставит в очередь произвольную операцию с чипом. Future получает её результат.
+        """
+        if future is None:
+            future = Future()
+        self.queue.put((job, future))
+        return future
+
+    def run(self):
+        while True:
+            job, future = self.queue.get()
+            try:
+                result = job()
+            except Exception as e:
+                print(f"Ошибка записи в контроллер {hex(self.address)}: {e}")
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+
+def get_write_queue(bus, address):
+    """
+    Возвращает очередь записи для чипа, создавая её при первом обращении (один поток на адрес).
+    """
+    with _write_queues_lock:
+        write_queue = _write_queues.get((bus.bus_num, address))
+        if write_queue is None:
+            write_queue = RelayWriteQueue(bus, address)
+            _write_queues[(bus.bus_num, address)] = write_queue
+        return write_queue
+
 
 class RelayController:
-    def __init__(self, address, bus_num=1):
+    __slots__ = ('__address', '__bus', '__state', '__queue', '__lock', '__pulse_widths', '__pending')
+
+    def __init__(self, address, bus_num=1, async_writes=False, bus=None):
         """
         Конструктор инициализирует I2C-шину и адрес устройства.
+        Шина берётся из общего менеджера (i2c_bus.get_bus), если не передана явно.
+        При async_writes=True запись выполняется в фоне через очередь чипа,
+        а методы изменения состояния возвращаются сразу.
         """
         self.__address = address
-        self.__bus = smbus.SMBus(bus_num)
-        self.__state = '11111111'  # Начальное состояние (все биты установлены в 1)
-        self.__bus.write_byte_data(self.__address, 0x09, int(self.__state, 2))
-        print(f"Инициализация контроллера реле по адресу {hex(self.__address)}, начальное состояние: {bin(int(self.__state, 2))}")
+        self.__bus = bus if bus is not None else get_bus(bus_num)
+        self.__queue = get_write_queue(self.__bus, address) if async_writes else None
+        self.__lock = threading.Lock()
+        self.__pulse_widths = collections.deque(maxlen=100)  # измеренные длительности последних импульсов
+        self.__pending = 0  # изменения кэша, ещё не записанные в чип
+        self.__state = 0xFF  # Начальное состояние (все биты установлены в 1)
+        self.__update(set_mask=0xFF, delay=0)
+        print(f"Инициализация контроллера реле по адресу {hex(self.__address)}, начальное состояние: {bin(self.__state)}")
 
     def set_state(self, state, delay=0.2):
         """
         Устанавливает полное состояние для всех битов сразу.
         """
-        self.__state = f'{state:08b}'  # Преобразуем в двоичное строковое представление
-        print(f"Установка состояния {bin(int(self.__state, 2))} для контроллера {hex(self.__address)}")
-        self.__bus.write_byte_data(self.__address, 0x09, int(self.__state, 2))
-        time.sleep(delay)
+        old_state, new_state, future = self.__update(set_mask=state & 0xFF, clear_mask=~state & 0xFF, delay=delay)
+        print(f"Установка состояния {bin(new_state)} для контроллера {hex(self.__address)}")
+        return future
 
     def set_bit(self, bit, delay=0.2):
         """
         Устанавливает конкретный бит в 1, обновляя состояние.
         """
-        old_state = self.__state
-        state_list = list(self.__state)
-        state_list[7 - bit] = '1'
-        self.__state = ''.join(state_list)
-        print(f"Установка бита {bit} для контроллера {hex(self.__address)}: {old_state} -> {self.__state}")
-        self.__bus.write_byte_data(self.__address, 0x09, int(self.__state, 2))
-        time.sleep(delay)
+        old_state, new_state, future = self.__update(set_mask=1 << bit, delay=delay)
+        print(f"Установка бита {bit} для контроллера {hex(self.__address)}: {old_state:08b} -> {new_state:08b}")
+        return future
 
     def clear_bit(self, bit, delay=0.2):
         """
         Сбрасывает конкретный бит в 0, обновляя состояние.
         """
-        old_state = self.__state
-        state_list = list(self.__state)
-        state_list[7 - bit] = '0'  # Меняем бит на 0
-        self.__state = ''.join(state_list)
-        print(f"Сброс бита {bit} для контроллера {hex(self.__address)}: {old_state} -> {self.__state}")
-        self.__bus.write_byte_data(self.__address, 0x09, int(self.__state, 2))
-        time.sleep(delay)
+        old_state, new_state, future = self.__update(clear_mask=1 << bit, delay=delay)
+        print(f"Сброс бита {bit} для контроллера {hex(self.__address)}: {old_state:08b} -> {new_state:08b}")
+        return future
 
     def toggle_bit(self, bit, delay=0.2):
         """
         Переключает бит (вкл/выкл), обновляя состояние.
         """
-        old_state = self.__state
-        state_list = list(self.__state)
-        state_list[7 - bit] = '0' if state_list[7 - bit] == '1' else '1' # Инвертируем бит
-        self.__state = ''.join(state_list)
-        print(f"Переключение бита {bit} для контроллера {hex(self.__address)}: {old_state} -> {self.__state}")
-        self.__bus.write_byte_data(self.__address, 0x09, int(self.__state, 2))
-        time.sleep(delay)
+        old_state, new_state, future = self.__update(toggle_mask=1 << bit, delay=delay)
+        print(f"Переключение бита {bit} для контроллера {hex(self.__address)}: {old_state:08b} -> {new_state:08b}")
+        return future
+
+    def apply(self, set_mask=0, clear_mask=0, delay=0.2):
+        """
+        Устанавливает биты из set_mask и сбрасывает биты из clear_mask одной записью в шину.
+        """
+        old_state, new_state, future = self.__update(set_mask=set_mask, clear_mask=clear_mask, delay=delay)
+        print(f"Применение масок set={set_mask:08b} clear={clear_mask:08b} для контроллера {hex(self.__address)}: {old_state:08b} -> {new_state:08b}")
+        return future
+
+    @contextmanager
+    def transaction(self, delay=0.2):
+        """
+        Собирает изменения битов внутри блока with и записывает их одной командой при выходе.
+        """
+        tx = RelayTransaction()
+        yield tx
+        tx.future = self.apply(tx.set_mask, tx.clear_mask, delay)
+
+    def pulse(self, bit, width, level=0):
+        """
+        Выдаёт импульс: бит переводится в level на width секунд и возвращается обратно,
+        без паузы установки после записи. В асинхронном режиме импульс выполняется потоком
+        очереди чипа и не прерывается другими записями. Измеренная длительность сохраняется
+        в истории (pulse_widths) и возвращается через Future.
+        """
+        mask = 1 << bit
+        with self.__locked():
+            idle_state = self.__state & ~mask if level else self.__state | mask
+            active_state = idle_state | mask if level else idle_state & ~mask
+            self.__state = idle_state
+            if self.__queue is not None:
+                self.__pending += 1
+
+                def job():
+                    try:
+                        measured = write_pulse(self.__bus, self.__address, active_state, idle_state, width)
+                    finally:
+                        self.__written()
+                    self.__pulse_widths.append(measured)
+                    return measured
+                future = self.__queue.put_job(job)
+            else:
+                measured = write_pulse(self.__bus, self.__address, active_state, idle_state, width)
+                self.__pulse_widths.append(measured)
+                future = Future()
+                future.set_result(measured)
+        print(f"Импульс бита {bit} ({width * 1000:.1f} мс) для контроллера {hex(self.__address)}")
+        return future
+
+    def stage(self, set_mask=0, clear_mask=0, delay=0.2, write=None):
+        """
+        Для асинхронного режима: изменяет кэш и ставит в очередь чипа задание, которое вызывает
+        write(new_state) вместо собственной записи в шину (например, общую запись RelayBank).
+        Задание выполняется после всех уже поставленных записей этого чипа, затем выдерживается delay.
+        Возвращает (старое состояние, новое состояние, Future записи).
+        """
+        with self.__locked():
+            old_state = self.__state
+            new_state = (old_state | set_mask) & ~clear_mask & 0xFF
+            self.__state = new_state
+            self.__pending += 1
+            future = Future()
+
+            def job():
+                try:
+                    future.written_at = write(new_state)
+                finally:
+                    self.__written()
+                if delay:
+                    time.sleep(delay)
+                return new_state
+            self.__queue.put_job(job, future)
+        return old_state, new_state, future
+
+    def pulse_widths(self):
+        """
+        Возвращает измеренные длительности последних импульсов в секундах.
+        """
+        return list(self.__pulse_widths)
+
+    def __update(self, set_mask=0, clear_mask=0, toggle_mask=0, delay=0.2):
+        """
+        Атомарно изменяет состояние и отправляет его в чип. Изменение и запись (или постановка
+        в очередь) выполняются под блокировкой, поэтому параллельные вызовы не теряют биты
+        и попадают в шину в том же порядке, что и в кэш. Пауза delay в синхронном режиме
+        выдерживается вне блокировки.
+        Возвращает (старое состояние, новое состояние, Future записи).
+        """
+        with self.__locked():
+            old_state = self.__state
+            new_state = ((old_state | set_mask) & ~clear_mask ^ toggle_mask) & 0xFF
+            self.__state = new_state
+            if self.__queue is not None:
+                self.__pending += 1
+                return old_state, new_state, self.__queue.put(new_state, delay, self.__written)
+            self.__bus.write_byte_data(self.__address, 0x09, new_state)
+            written_at = time.monotonic()
+        if delay:
+            time.sleep(delay)
+        future = Future()
+        future.written_at = written_at
+        future.set_result(new_state)
+        return old_state, new_state, future
+
+    @contextmanager
+    def __locked(self):
+        """
+        Порядок блокировок: сначала шина, затем состояние контроллера (так же их берут RelayBank и сверка).
+        Синхронная запись держит обе, поэтому под захватом шины кэш и чип не расходятся;
+        асинхронная держит только блокировку состояния, а шину берёт поток очереди,
+        и незаписанные изменения учитываются счётчиком __pending.
+        """
+        if self.__queue is not None:
+            with self.__lock:
+                yield
+        else:
+            with self.__bus.lock, self.__lock:
+                yield
+
+    def __written(self):
+        """
+        Отмечает, что одна из отложенных записей дошла до чипа (вызывается потоком очереди).
+        """
+        with self.__lock:
+            self.__pending -= 1
+
+    def resync(self, delay=0):
+        """
+        Повторно записывает кэшированное состояние в чип одной командой (восстановление после сбоя).
+        """
+        old_state, new_state, future = self.__update(delay=delay)
+        print(f"Восстановление состояния {new_state:08b} для контроллера {hex(self.__address)}")
+        return future
+
+    def has_pending_writes(self):
+        """
+        Возвращает True, если кэш содержит изменения, ещё не записанные в чип.
+        """
+        return self.__pending > 0
+
+    def get_address(self):
+        return self.__address
+
+    def is_async(self):
+        return self.__queue is not None
 
     def check_bit(self, bit):
         """
         Проверяет состояние конкретного бита (0 или 1).
         """
-        bit_state = self.__state[7 - bit]
-        return bit_state
+        return '1' if self.__state & (1 << bit) else '0'
 
     def get_state(self):
         """
         Возвращает текущее состояние всех битов в виде целого числа.
 
         """
-        return int(self.__state, 2)  # Преобразуем строку в число
+        return self.__state
+
+
+BANK_BASE_ADDRESS = 0x38
+BANK_SIZE = 8
+
+
+class RelayBank:
+    """
+    Группа PCA-расширителей 0x38-0x3F как один 64-битный логический регистр:
+    логический бит = (адрес - 0x38) * 8 + бит чипа. Изменение раскладывается по чипам,
+    и записываются только чипы, состояние которых действительно меняется, подряд за один захват шины.
+    """
+
+    def __init__(self, bus, controllers):
+        self.bus = bus
+        self.controllers = {}
+        for controller in controllers:
+            index = controller.get_address() - BANK_BASE_ADDRESS
+            if not 0 <= index < BANK_SIZE:
+                raise Exception(f"Адрес {hex(controller.get_address())} вне диапазона 0x38-0x3F")
+            self.controllers[index] = controller
+
+    @staticmethod
+    def bit(address, bit):
+        """
+        Номер логического бита для бита bit чипа с адресом address.
+        """
+        return (address - BANK_BASE_ADDRESS) * 8 + bit
+
+    def get_state(self):
+        state = 0
+        for index, controller in self.controllers.items():
+            state |= controller.get_state() << (index * 8)
+        return state
+
+    def set_bit(self, bit, delay=0.2):
+        return self.apply(set_mask=1 << bit, delay=delay)
+
+    def clear_bit(self, bit, delay=0.2):
+        return self.apply(clear_mask=1 << bit, delay=delay)
+
+    def apply(self, set_mask=0, clear_mask=0, delay=0.2):
+        """
+        Применяет 64-битные маски. Возвращает список Future по записанным чипам.
+        Синхронные контроллеры пишутся подряд без пауз, после чего один раз выдерживается delay.
+        Асинхронные ставят в очереди своих чипов общее задание: когда очередь каждого чипа
+        доходит до него (все ранее поставленные записи выполнены), последний пришедший поток
+        записывает все чипы подряд за один захват шины, а пауза delay выдерживается потоками очередей.
+        """
+        futures = []
+        wait = False
+        with self.bus.session():
+            changes = []
+            for index, controller in sorted(self.controllers.items()):
+                chip_set = (set_mask >> (index * 8)) & 0xFF
+                chip_clear = (clear_mask >> (index * 8)) & 0xFF
+                if not chip_set and not chip_clear:
+                    continue
+                old_state = controller.get_state()
+                if (old_state | chip_set) & ~chip_clear & 0xFF == old_state:
+                    continue
+                if controller.is_async():
+                    changes.append((controller, chip_set, chip_clear))
+                else:
+                    futures.append(controller.apply(chip_set, chip_clear, 0))
+                    wait = True
+            if changes:
+                futures.extend(self.__stage_together(changes, delay))
+        if wait:
+            time.sleep(delay)
+        return futures
+
+    def __stage_together(self, changes, delay):
+        """
+        Ставит изменения асинхронных чипов в их очереди так, чтобы запись в шину шла одной серией.
+        Если запись не удалась, исключение получают Future всех чипов серии.
+        """
+        states = {}
+        written = {}
+
+        def write_all():
+            with self.bus.session():
+                for address, state in sorted(states.items()):
+                    self.bus.write_byte_data(address, 0x09, state)
+                written["at"] = time.monotonic()
+
+        barrier = threading.Barrier(len(changes), action=write_all)
+        futures = []
+        for controller, chip_set, chip_clear in changes:
+            address = controller.get_address()
+
+            def write(new_state, address=address):
+                states[address] = new_state
+                barrier.wait()
+                return written["at"]
+            futures.append(controller.stage(chip_set, chip_clear, delay, write)[2])
+            print(f"Применение масок set={chip_set:08b} clear={chip_clear:08b} для контроллера {hex(address)} (группа)")
+        return futures
+
+    @contextmanager
+    def transaction(self, delay=0.2):
+        """
+        Собирает изменения логических битов внутри блока with и применяет их при выходе.
+        """
+        tx = RelayTransaction()
+        yield tx
+        tx.future = self.apply(tx.set_mask, tx.clear_mask, delay)
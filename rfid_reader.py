@@ -0,0 +1,350 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import serial
+
+from config import logger
+
+STX = 0x02
+ETX = 0x03
+
+# значение ASCII-символа шестнадцатеричной цифры, -1 для остальных байтов
+HEX_VALUES = tuple(int(chr(c), 16) if chr(c) in "0123456789ABCDEFabcdef" else -1 for c in range(256))
+
+RfidRead = namedtuple("RfidRead", ("key", "first_byte_at", "received_at"))
+RfidRead.__doc__ = """
+Считанный ключ: first_byte_at - время прихода первого байта кадра (начало считывания),
+received_at - время, когда кадр собран и ключ поставлен в очередь (монотонные часы).
+"""
+
+
+class RfidFrameParser:
+    """
+    Разбор кадров считывателя: STX, данные (ASCII hex), контрольная сумма (2 символа hex), ETX.
+    Контрольная сумма - XOR байтов данных. Принятые байты копируются в кольцевой буфер,
+    кадр проверяется прямо в буфере через memoryview, без срезов и промежуточных bytes;
+    объект создаётся только для ключа корректного кадра.
+
+    Если кадр испорчен (нет ETX на своём месте, не hex-символ, неверная сумма), он считается
+    плохим, и разбор продолжается со следующего STX - теряется один кадр, а не весь поток.
+    Счётчики: good - корректные кадры, bad - отброшенные кадры, resynced - случаи пропуска
+    байтов до следующего STX.
+    """
+
+    def __init__(self, frame_length=14, size=256):
+        if frame_length < 6 or frame_length % 2:
+            raise ValueError(f"RFID frame length must be even and at least 6, {frame_length} given")
+        assert size & (size - 1) == 0, "Ring buffer size must be a power of two"
+        self.frame_length = frame_length
+        self.data_length = frame_length - 4
+        self.ring = bytearray(size)
+        self.view = memoryview(self.ring)
+        self.mask = size - 1
+        self.head = 0
+        self.count = 0
+        self.good = 0
+        self.bad = 0
+        self.resynced = 0
+        self.overflowed = 0
+
+    def feed(self, data):
+        """
+        Добавляет принятые байты и возвращает список ключей (строки hex без суммы) из собранных кадров.
+        """
+        size = len(self.ring)
+        if len(data) > size:
+            data = memoryview(data)[-size:]
+        free = size - self.count
+        if len(data) > free:
+            # при переполнении выбрасываются самые старые байты
+            self.overflowed += 1
+            self.head = (self.head + len(data) - free) & self.mask
+            self.count -= len(data) - free
+        tail = (self.head + self.count) & self.mask
+        first = min(len(data), size - tail)
+        self.view[tail:tail + first] = data[:first]
+        if first < len(data):
+            self.view[:len(data) - first] = data[first:]
+        self.count += len(data)
+        return self.parse()
+
+    def skip(self, count):
+        self.head = (self.head + count) & self.mask
+        self.count -= count
+
+    def parse(self):
+        keys = []
+        ring = self.ring
+        while self.count:
+            if ring[self.head] != STX:
+                while self.count and ring[self.head] != STX:
+                    self.skip(1)
+                self.resynced += 1
+                continue
+            if self.count < self.frame_length:
+                break
+            key = self.validate()
+            if key is None:
+                self.bad += 1
+                self.skip(1)
+                continue
+            self.good += 1
+            self.skip(self.frame_length)
+            keys.append(key)
+        return keys
+
+    def validate(self):
+        """
+        Проверяет кадр в начале буфера и возвращает ключ или None.
+        """
+        ring = self.ring
+        mask = self.mask
+        start = self.head + 1
+        if ring[(self.head + self.frame_length - 1) & mask] != ETX:
+            return None
+        checksum = 0
+        for offset in range(0, self.data_length + 2, 2):
+            high = HEX_VALUES[ring[(start + offset) & mask]]
+            low = HEX_VALUES[ring[(start + offset + 1) & mask]]
+            if high < 0 or low < 0:
+                return None
+            checksum ^= high << 4 | low
+        # XOR данных с суммой даёт 0 для корректного кадра
+        if checksum:
+            return None
+        if start + self.data_length <= len(ring):
+            key = bytes(self.view[start:start + self.data_length])
+        else:
+            key = bytes(ring[(start + offset) & mask] for offset in range(self.data_length))
+        return key.decode("ascii").upper()
+
+    def stats(self):
+        return {"good": self.good, "bad": self.bad, "resynced": self.resynced, "overflowed": self.overflowed}
+
+
+class RfidKeyReader:
+    """
+    Общая часть считывателей RFID с постоянно открытым портом: разбор кадров RfidFrameParser,
+    подавление повторов, очередь ключей с отметками времени и статистика. Порт не переоткрывается
+    и не очищается между считываниями, поэтому карта, поднесённая в любой момент, не теряется.
+
+    Повторы ключа, для которого идёт цикл замка (door_cycle), отбрасываются, пока цикл не закончится
+    (карту держат у считывателя, пока дверь открыта), и ещё repeat_window секунд после него.
+    Без цикла (неизвестный ключ) повтор отбрасывается в течение repeat_window после последнего
+    ключа, поставленного в очередь. Другой ключ принимается сразу.
+    При ошибке порта он закрывается и открывается снова через reopen_delay.
+    """
+
+    def __init__(self, port="/dev/ttyS0", baudrate=9600, frame_length=14, reopen_delay=1.0, repeat_window=1.0):
+        self.port = port
+        self.baudrate = baudrate
+        self.frame_length = frame_length
+        self.reopen_delay = reopen_delay
+        self.repeat_window = repeat_window
+        self.last_key = None  # последний ключ, поставленный в очередь (или ключ завершённого цикла замка)
+        self.last_key_at = float("-inf")
+        self.cycle_key = None  # ключ, для которого сейчас идёт цикл замка
+        self.suppressed = 0
+        self.keys = None  # очередь ключей задаёт конкретный считыватель
+        self.parser = RfidFrameParser(frame_length)
+        self.first_byte_at = None
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.reopened = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.taken = 0
+
+    def feed(self, data, now):
+        """
+        Передаёт принятые байты разборщику и ставит в очередь ключи собранных кадров.
+        """
+        if self.first_byte_at is None and STX in data:
+            self.first_byte_at = now
+        with self.lock:
+            keys = self.parser.feed(data)
+        for key in keys:
+            self.put(key, self.first_byte_at or now, now)
+        # начало следующего кадра уже могло прийти в этом же блоке
+        self.first_byte_at = now if self.parser.count else None
+
+    def put(self, key, first_byte_at, received_at):
+        latency = received_at - first_byte_at
+        with self.lock:
+            self.frames += 1
+            self.latency_total += latency
+            self.latency_last = latency
+            self.latency_max = max(self.latency_max, latency)
+            if key == self.cycle_key or (key == self.last_key and received_at - self.last_key_at < self.repeat_window):
+                self.suppressed += 1
+                return
+            try:
+                self.keys.put_nowait(RfidRead(key, first_byte_at, received_at))
+            except (queue.Full, asyncio.QueueFull):
+                logger.warning(f"Очередь ключей RFID переполнена, ключ {key} пропущен")
+                return
+            self.last_key = key
+            self.last_key_at = received_at
+
+    @contextmanager
+    def door_cycle(self, key):
+        """
+        Отмечает цикл замка для ключа key: пока выполняется блок with, повторы этого ключа
+        отбрасываются, после выхода - ещё repeat_window секунд. Вызывается из потока обработки ключей.
+        """
+        with self.lock:
+            self.cycle_key = key
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.cycle_key = None
+                self.last_key = key
+                self.last_key_at = time.monotonic()
+
+    def taken_from_queue(self, read):
+        wait = time.monotonic() - read.received_at
+        with self.lock:
+            self.taken += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        return read
+
+    def port_failed(self, error):
+        logger.error(f"Ошибка порта RFID {self.port}: {str(error)}")
+        self.first_byte_at = None
+        with self.lock:
+            self.reopened += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "frames": self.frames,
+                "parser": self.parser.stats(),
+                "reopened": self.reopened,
+                "suppressed": self.suppressed,
+                "queued": self.keys.qsize(),
+                "swipe_to_key_ms": {
+                    "last": round(self.latency_last * 1000, 3),
+                    "max": round(self.latency_max * 1000, 3),
+                    "mean": round(self.latency_total / self.frames * 1000, 3) if self.frames else 0,
+                },
+                "key_wait_ms": {
+                    "max": round(self.wait_max * 1000, 3),
+                    "mean": round(self.wait_total / self.taken * 1000, 3) if self.taken else 0,
+                },
+            }
+
+
+class RfidReader(RfidKeyReader):
+    """
+    Считыватель в отдельном потоке: блокирующее чтение порта, ключи в queue.Queue.
+    """
+
+    def __init__(self, port="/dev/ttyS0", baudrate=9600, frame_length=14, reopen_delay=1.0, maxsize=16,
+                 repeat_window=1.0):
+        RfidKeyReader.__init__(self, port, baudrate, frame_length, reopen_delay, repeat_window)
+        self.keys = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def get(self, timeout=None):
+        """
+        Ждёт следующий ключ не дольше timeout секунд. Возвращает RfidRead или None.
+        """
+        try:
+            return self.taken_from_queue(self.keys.get(timeout=timeout))
+        except queue.Empty:
+            return None
+
+    def run(self):
+        rfid_port = None
+        while True:
+            try:
+                if rfid_port is None:
+                    rfid_port = serial.Serial(self.port, self.baudrate, timeout=0.5)
+                    logger.info(f"Порт считывателя RFID {self.port} открыт")
+                data = rfid_port.read(rfid_port.in_waiting or 1)
+                if data:
+                    self.feed(data, time.monotonic())
+            except Exception as e:
+                self.port_failed(e)
+                try:
+                    rfid_port.close()
+                except Exception:
+                    pass
+                rfid_port = None
+                time.sleep(self.reopen_delay)
+
+
+class AsyncRfidReader(RfidKeyReader):
+    """
+    Считыватель в цикле событий asyncio: порт открыт в неблокирующем режиме, данные читаются
+    обработчиком loop.add_reader, когда они есть, ключи попадают в asyncio.Queue. Отдельных
+    потоков нет, в простое ничего не просыпается. Все методы, кроме door_cycle, вызываются
+    из потока цикла.
+    """
+
+    def __init__(self, port="/dev/ttyS0", baudrate=9600, frame_length=14, reopen_delay=1.0, maxsize=16,
+                 repeat_window=1.0):
+        RfidKeyReader.__init__(self, port, baudrate, frame_length, reopen_delay, repeat_window)
+        self.keys = asyncio.Queue(maxsize)
+        self.loop = None
+        self.rfid_port = None
+
+    def start(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.open()
+
+    def open(self):
+        try:
+            self.rfid_port = serial.Serial(self.port, self.baudrate, timeout=0)
+            self.loop.add_reader(self.rfid_port.fileno(), self.readable)
+            logger.info(f"Порт считывателя RFID {self.port} открыт (asyncio)")
+        except Exception as e:
+            self.failed(e)
+
+    def readable(self):
+        try:
+            data = os.read(self.rfid_port.fileno(), 256)
+        except BlockingIOError:
+            return
+        except Exception as e:
+            self.failed(e)
+            return
+        if not data:
+            self.failed(OSError("port closed"))
+            return
+        self.feed(data, time.monotonic())
+
+    def failed(self, error):
+        self.port_failed(error)
+        if self.rfid_port is not None:
+            try:
+                self.loop.remove_reader(self.rfid_port.fileno())
+                self.rfid_port.close()
+            except Exception:
+                pass
+            self.rfid_port = None
+        self.loop.call_later(self.reopen_delay, self.open)
+
+    async def get(self, timeout=None):
+        """
+        Ждёт следующий ключ не дольше timeout секунд. Возвращает RfidRead или None.
+        """
+        try:
+            read = await asyncio.wait_for(self.keys.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.taken_from_queue(read)